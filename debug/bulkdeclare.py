@@ -0,0 +1,35 @@
+from digimat.saia import SAIANode
+import random
+import time
+
+# Bulk declaration benchmark : declaring a point list of 50000 registers (runs of 1 to 64
+# consecutive indexes with holes) item by item (declare) vs at once (declareBulk)
+
+COUNT=50000
+
+random.seed(0)
+indexes=[]
+index=0
+while len(indexes)<COUNT:
+    count=random.randint(1, 64)
+    indexes.extend(range(index, index+count))
+    index+=count+random.randint(1, 16)
+indexes=indexes[:COUNT]
+random.shuffle(indexes)
+
+node=SAIANode(253, port=15099)
+node.stop()
+
+server=node.servers.declare('192.168.0.100', lid=2)
+t0=time.time()
+for index in indexes:
+    server.registers.declare(index)
+dt0=time.time()-t0
+print('declare    : %d items in %.03fs (%.01fus/item)' % (server.registers.count(), dt0, dt0/COUNT*1e6))
+
+server=node.servers.declare('192.168.0.101', lid=2)
+t0=time.time()
+server.registers.declareBulk(indexes)
+dt1=time.time()-t0
+print('declareBulk: %d items in %.03fs (%.01fus/item, x%.0f)' % (server.registers.count(), dt1, dt1/COUNT*1e6, dt0/dt1))
+print('pending pulls: %d' % server.registers.countPendingPull())
@@ -0,0 +1,71 @@
+from digimat.saia import SAIANode
+from digimat.saia.request import SAIARequestReadRegisters
+from digimat.saia.request import SAIASBusCRCTableCheck
+import time
+
+# Encoded frame template cache benchmark : CPU time per READ frame built from scratch
+# (createFrameWithPayload + full CRC) vs patched from the link frame cache
+
+COUNT=100000
+
+node=SAIANode(253, port=15099)
+server=node.servers.declare('192.168.0.100', lid=2)
+link=server.link
+registers=server.registers.declareRange(0, 256)
+
+requests=[]
+for n in range(0, 256, 32):
+    request=SAIARequestReadRegisters(link)
+    request.setup(registers[n], maxcount=32)
+    requests.append(request)
+
+# same frames from both paths
+for request in requests:
+    for sequence in (1, 255, 256, 4660, 65535):
+        request._sequence=sequence
+        assert link.frameCache.frame(request, request.encode())==request.createFrameWithPayload(request.encode())
+
+# frame encoding only
+t0=time.time()
+for n in range(COUNT):
+    request=requests[n % len(requests)]
+    request._sequence=link.generateMsgSeq()
+    data=request.createFrameWithPayload(request.encode())
+dt0=time.time()-t0
+
+t0=time.time()
+for n in range(COUNT):
+    request=requests[n % len(requests)]
+    request._sequence=link.generateMsgSeq()
+    data=link.frameCache.frame(request, request.encode())
+dt1=time.time()-t0
+
+print('frame encoding')
+print('  build: %.02fus/frame' % (dt0/COUNT*1e6))
+print('  cache: %.02fus/frame (x%.01f)' % (dt1/COUNT*1e6, dt0/dt1))
+
+# whole poll (request creation, setup with the planned frame, frame), as done by the memory manager
+t0=time.time()
+for n in range(COUNT):
+    request=SAIARequestReadRegisters(link)
+    SAIASBusCRCTableCheck()
+    server.registers._framePull=((n*32) % 256, 32)
+    request.setup(registers[(n*32) % 256], maxcount=32)
+    request._sequence=link.generateMsgSeq()
+    data=request.createFrameWithPayload(request.encode())
+dt0=time.time()-t0
+
+t0=time.time()
+for n in range(COUNT):
+    request=SAIARequestReadRegisters(link)
+    server.registers._framePull=((n*32) % 256, 32)
+    request.setup(registers[(n*32) % 256], maxcount=32)
+    data=request.build()
+dt1=time.time()-t0
+
+print('poll')
+print('  build: %.02fus/frame' % (dt0/COUNT*1e6))
+print('  cache: %.02fus/frame (x%.01f)' % (dt1/COUNT*1e6, dt0/dt1))
+print(link.frameCache)
+
+node.stop()
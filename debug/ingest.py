@@ -0,0 +1,33 @@
+from digimat.saia import SAIANode
+import time
+
+# Bulk response ingestion benchmark : CPU time to apply the decoded values of a 32 registers
+# READ response to the collection, item per item (setValue, one lock per value) vs in bulk
+# (ingestValues, one lock per frame)
+
+COUNT=20000
+
+node=SAIANode(253, port=15099)
+server=node.servers.declare('192.168.0.100', lid=2)
+server.registers.declareRange(0, 256)
+registers=server.registers
+node.stop()
+values=tuple(range(32))
+
+t0=time.time()
+for n in range(COUNT):
+    index0=(n*32) % 256
+    for i in range(32):
+        item=registers.item(index0+i)
+        if item:
+            item.setValue(values[i], force=True)
+            item.clearPull()
+dt0=time.time()-t0
+
+t0=time.time()
+for n in range(COUNT):
+    registers.ingestValues((n*32) % 256, values)
+dt1=time.time()-t0
+
+print('per item: %.02fus/frame' % (dt0/COUNT*1e6))
+print('bulk    : %.02fus/frame (x%.01f)' % (dt1/COUNT*1e6, dt0/dt1))
@@ -0,0 +1,58 @@
+from digimat.saia import SAIANode
+import tracemalloc
+import time
+import sys
+
+# Columnar item store benchmark : memory used and refresh scan time (one pass over every
+# declared index) for N registers with item objects vs with the columnar store (no item).
+# Registers are spread over servers of 50000 registers. Item objects at 1M are only
+# measured with --full (several GB)
+
+SIZES=[10000, 100000, 1000000]
+PERSERVER=50000
+
+node=SAIANode(253, port=15099)
+node.stop()
+hosts=[]
+
+
+def declare(count, store):
+    servers=[]
+    while count>0:
+        hosts.append(len(hosts)+1)
+        server=node.servers.declare('10.0.%d.%d' % (len(hosts)//250, len(hosts) % 250+1), lid=2)
+        if store:
+            server.enableItemStore()
+            server.registers.declareIndexes(0, min(count, PERSERVER))
+        else:
+            server.registers.declareFromList(range(min(count, PERSERVER)))
+        count-=PERSERVER
+        servers.append(server)
+    return servers
+
+
+def scan(servers, store):
+    t0=time.time()
+    for server in servers:
+        registers=server.registers
+        if store:
+            registers.scanStore(count=None)
+        else:
+            for item in registers.all():
+                item.manager()
+    return time.time()-t0
+
+
+for size in SIZES:
+    for store in (0, 1):
+        if not store and size>100000 and '--full' not in sys.argv:
+            print('%7d items: skipped' % size)
+            continue
+        tracemalloc.start()
+        t0=time.time()
+        servers=declare(size, store)
+        dt=time.time()-t0
+        (current, peak)=tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%7d %s: declare %.02fs, %.01f MB (%d bytes/item), scan %.01fms' % (size,
+            'store' if store else 'items', dt, current/1e6, current//size, scan(servers, store)*1e3))
@@ -0,0 +1,42 @@
+from digimat.saia import SAIANode
+import tracemalloc
+import time
+
+# Lazy range declaration benchmark : time and memory to declare a point list of RANGES ranges
+# of COUNT registers with declareRange (lazy, items created on access) vs declaring every item
+
+RANGES=100
+COUNT=500
+
+node=SAIANode(253, port=15099)
+node.stop()
+
+for lazy in (False, True):
+    server=node.servers.declare('192.168.0.%d' % (100+lazy), lid=2)
+    tracemalloc.start()
+    t0=time.time()
+    for n in range(RANGES):
+        index=n*(COUNT+100)
+        if lazy:
+            server.registers.declareRange(index, COUNT)
+        else:
+            server.registers.declareFromList(range(index, index+COUNT))
+    dt=time.time()-t0
+    (current, peak)=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%s: %d items declared in %.03fs, %.01f MB' % ('lazy ' if lazy else 'items',
+        server.registers.count(), dt, current/1e6))
+
+t0=time.time()
+values=[item.value for item in server.registers.declareRange(0, COUNT)]
+print('first access of %d lazy items: %.03fs' % (COUNT, time.time()-t0))
+
+# the collection wide accessors read the store, only the accessed items are created
+registers=server.registers
+t0=time.time()
+items=list(registers)
+(alive, dead, active)=(registers.alive(), registers.dead(), registers.active())
+snapshot=registers.snapshot()
+print('iterate/alive/dead/active/snapshot of %d indexes: %.03fs, %d items objects' % (len(snapshot),
+    time.time()-t0, registers.stats()['objects']))
+assert len(items)==COUNT and len(dead)==registers.count() and registers.stats()['objects']==COUNT
@@ -0,0 +1,60 @@
+from digimat.saia import SAIANode
+from digimat.saia.server import SAIALink
+from digimat.saia.request import SAIARequestReadRegisters
+import tracemalloc
+import struct
+
+# Pooled requests benchmark : memory allocated per READ frame in steady state polling
+# (request, setup with the planned frame, frame, response processing), with a new request
+# object per frame vs a request recycled from the link pool. Requires python>=3.9 (reset_peak)
+
+COUNT=20000
+
+node=SAIANode(253, port=15099)
+server=node.servers.declare('192.168.0.100', lid=2)
+link=server.link
+registers=server.registers.declareRange(0, 256)
+# the link is driven by the benchmark, not by the background task
+node.stop()
+payload=struct.pack('>32I', *range(32))
+
+
+def poll(n, pooled):
+    index=(n*32) % 256
+    if pooled:
+        request=link.acquire(SAIARequestReadRegisters)
+    else:
+        request=SAIARequestReadRegisters(link)
+    server.registers._framePull=(index, 32)
+    request.setup(registers[index], maxcount=32)
+    link.initiate(request)
+    data=request.data
+    # simulated server response
+    link.setState(SAIALink.COMMSTATE_WAITRESPONSE, 0.5)
+    link.onMessage(1, request.sequence, payload)
+
+
+def bench(pooled):
+    for n in range(1000):
+        poll(n, pooled)
+
+    transient=0
+    (start, peak)=tracemalloc.get_traced_memory()
+    for n in range(COUNT):
+        (current, peak)=tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        poll(n, pooled)
+        (after, peak)=tracemalloc.get_traced_memory()
+        transient+=peak-current
+    (end, peak)=tracemalloc.get_traced_memory()
+    return (transient/COUNT, (end-start)/COUNT)
+
+
+tracemalloc.start()
+for pooled in (False, True):
+    (transient, net)=bench(pooled)
+    print('%s: %.0f bytes/frame allocated (peak), %.02f bytes/frame retained' % (
+        'pooled' if pooled else 'new   ', transient, net))
+tracemalloc.stop()
+
+print(link.stats())
@@ -0,0 +1,117 @@
+from digimat.saia import SAIANode
+import threading
+import time
+
+# Item value reads benchmark : an I/O thread ingests read responses (32 registers frames)
+# while dashboard threads read the values, with item.value taking the collection lock vs
+# reading the attribute without lock, with item.snapshot() (published (value, stamp) pair,
+# without lock) and with the range snapshots (32 values copied under a short lock), on plain
+# items and on a store (lazy range). Reports the reads rate and the ingestion latency
+
+DURATION=3.0
+READERS=4
+
+node=SAIANode(253, port=15099)
+server=node.servers.declare('192.168.0.100', lid=2)
+# the collection is driven by the benchmark, not by the background task
+node.stop()
+registers=server.registers
+items=server.registers.declareFromList(range(1024))
+# same values in the store (lazy range), read by index
+server.counters.declareRange(0, 1024)
+counters=server.counters
+
+
+def lockedValue(item):
+    with registers._lock:
+        return item._value
+
+
+def reader(read, counter, stop):
+    n=0
+    while not stop.is_set():
+        for item in items[:256]:
+            read(item)
+        n+=256
+    counter.append(n)
+
+
+def rangeReader(collection, counter, stop):
+    n=0
+    while not stop.is_set():
+        for index in range(0, 256, 32):
+            collection.snapshot(index, index+32)
+        n+=256
+    counter.append(n)
+
+
+def bench(read, collection=None):
+    stop=threading.Event()
+    counter=[]
+    if collection is not None:
+        threads=[threading.Thread(target=rangeReader, args=(collection, counter, stop)) for n in range(READERS)]
+    else:
+        threads=[threading.Thread(target=reader, args=(read, counter, stop)) for n in range(READERS)]
+    for thread in threads:
+        thread.start()
+
+    latencies=[]
+    values=list(range(32))
+    t0=time.time()
+    n=0
+    while time.time()-t0<DURATION:
+        t=time.time()
+        registers.ingestValues((n*32) % 1024, values)
+        counters.ingestValues((n*32) % 1024, values)
+        latencies.append(time.time()-t)
+        n+=1
+        time.sleep(0.0005)
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return (sum(counter)/DURATION, latencies[len(latencies)//2], latencies[int(len(latencies)*0.99)])
+
+
+for (name, read, collection) in (('value (locked)          ', lockedValue, None),
+        ('value (lockless)        ', lambda item: item.value, None),
+        ('snapshot                ', lambda item: item.snapshot(), None),
+        ('range snapshot (items)  ', None, registers),
+        ('range snapshot (store)  ', None, counters)):
+    (rate, median, p99)=bench(read, collection)
+    print('%s: %.0f reads/s, ingest median %.0fus, p99 %.0fus' % (name, rate, median*1e6, p99*1e6))
+
+# consistency : (value, stamp) pairs written together are read together, the frames
+# being ingested with stamp=value (the store frames mixing items and indexes without item)
+stop=threading.Event()
+views=[counters.item(n) for n in range(0, 32, 4)]
+
+
+def writer():
+    n=1
+    while not stop.is_set():
+        registers.ingestValues(0, [n]*32, stamp=float(n))
+        counters.ingestValues(0, [n]*32, stamp=float(n))
+        n+=1
+
+
+thread=threading.Thread(target=writer)
+thread.start()
+errors=0
+reads=0
+t0=time.time()
+while time.time()-t0<1.0:
+    for collection in (registers, counters):
+        values=collection.snapshot(0, 32)
+        if len(set([(value, stamp) for (index, value, stamp) in values]))!=1 or values[0][1]!=values[0][2]:
+            errors+=1
+    for item in items[:32]+views:
+        (value, stamp)=item.snapshot()
+        if value!=stamp:
+            errors+=1
+    reads+=1
+stop.set()
+thread.join()
+assert errors==0
+print('snapshot consistency errors: %d (%d reads)' % (errors, reads))
@@ -0,0 +1,72 @@
+from digimat.saia import SAIANode
+import tracemalloc
+import gc
+
+# Undeclare soak test : a long running gateway declaring and undeclaring items (items, lazy
+# ranges, bulk declarations, groups, pending pushes and simulated read responses feeding the
+# change logs) must give back its memory : after a few warm-up cycles (first allocations of
+# the fixed size structures), the traced memory after each cycle must stay at the baseline
+
+CYCLES=50
+WARMUP=10
+# tolerance for the few scalars (timestamps, generations, logging timers) replaced at each
+# cycle, a leak growing with the cycles (50 x 1000s of items) being far above
+TOLERANCE=512
+
+node=SAIANode(253, port=15099)
+server=node.servers.declare('192.168.0.100', lid=2)
+# the collections are driven by the benchmark, not by the background task
+node.stop()
+registers=server.registers
+flags=server.flags
+
+
+def cycle(n):
+    base=(n*1000) % 20000
+    items=registers.declareFromList(range(base, base+200))
+    lazy=registers.declareRange(base+1000, 2000)
+    registers.declareBulk([range(base+5000, base+6000), range(base+8000, base+8100)])
+    bits=flags.declareRange(base, 1000)
+    group=server.group([items[0], lazy[10], lazy[1500], bits[5]])
+    group.refresh(urgent=True)
+    for item in items[:50]:
+        item.value=n
+    # simulated read responses, the second ones changing the values
+    generation=server.generation()
+    registers.ingestValues(base+1000, list(range(32)))
+    registers.ingestValues(base+1000, list(range(n+1, n+33)))
+    flags.ingestValues(base, [True]*64)
+    flags.ingestValues(base, [False]*64)
+    assert lazy[3].value==n+4
+    (generation, changes)=server.changesSince(generation)
+    assert len(changes)==96 and changes[0]==(registers, base+1000), changes[:2]
+
+    # undeclare, by item, group, range and the whole server
+    items[0].undeclare()
+    group.undeclare()
+    registers.undeclare(lazy)
+    registers.undeclare(range(base+5000, base+5500))
+    server.undeclare()
+    assert registers.count()==0 and flags.count()==0 and len(group)==0
+
+
+tracemalloc.start()
+for n in range(WARMUP):
+    cycle(n)
+# the loop variables are bound before the baseline, not counted as growth
+(current, peak, growth)=(0, 0, 0)
+gc.collect()
+(baseline, peak)=tracemalloc.get_traced_memory()
+for n in range(WARMUP, CYCLES+1):
+    cycle(n)
+    gc.collect()
+    (current, peak)=tracemalloc.get_traced_memory()
+    growth=max(growth, current-baseline)
+    if n % 10==0:
+        print('cycle %d: %d bytes traced (baseline %d, %+d), peak %d' % (n, current, baseline, current-baseline, peak))
+tracemalloc.stop()
+
+assert growth<=TOLERANCE, 'memory not reclaimed (%d bytes over the baseline)' % growth
+print('memory flat over %d cycles (max %+d bytes)' % (CYCLES-WARMUP+1, growth))
+
+print(registers.stats())
@@ -0,0 +1,67 @@
+from digimat.saia import SAIANode
+from digimat.saia.server import SAIALink
+
+# Failed combined writes : the values combined in a WRITE frame (after the head item) are
+# cleared from the pending pushes when the frame is built. After a NAK or a timeout (retries
+# exhausted) they must be pending again, while values written meanwhile are kept
+
+node=SAIANode(253, port=15099)
+server=node.servers.declare('192.168.0.100', lid=2)
+link=server.link
+registers=server.registers
+items=registers.declareFromList(range(16))
+# the link is driven by the script, not by the background task
+node.stop()
+server.setWriteCombiningDelay(0)
+
+
+def write(values, rewrite=None):
+    for n in range(len(values)):
+        items[n].value=values[n]
+    item=server.memory.getNextPendingPush()
+    assert item.index==0
+    item.push()
+    request=link._request
+    assert len(request._values)==len(values)
+    assert registers.countPendingPush()==0
+    if rewrite is not None:
+        # written again during the transaction
+        items[rewrite].value=999
+    return request
+
+
+def check(values, rewrite=None):
+    for n in range(1, len(values)):
+        assert items[n].isPendingPushRequest(), n
+        if n==rewrite:
+            assert items[n].pushValue==999
+        else:
+            assert items[n].pushValue==values[n]
+    assert not items[0].isPendingPushRequest()
+    # the next write frame starts after the dropped head item
+    assert server.memory.getNextPendingPush().index==1
+    for item in items:
+        item.clearPush()
+
+
+# NAK
+values=[10, 11, 12, 13, 14]
+request=write(values, rewrite=3)
+link.setState(SAIALink.COMMSTATE_WAITRESPONSE, 0.5)
+link.onMessage(2, request.sequence, b'\x00\x01')
+check(values, rewrite=3)
+
+# timeout (retries exhausted)
+values=[20, 21, 22]
+request=write(values)
+link.reset(False)
+check(values)
+
+# success : nothing pending again
+values=[30, 31, 32]
+request=write(values)
+link.setState(SAIALink.COMMSTATE_WAITRESPONSE, 0.5)
+link.onMessage(2, request.sequence, b'\x00\x00')
+assert registers.countPendingPush()==0
+
+print('combined write failures: ok')
@@ -0,0 +1,191 @@
+from __future__ import division
+
+
+class SAIAIndexBitmap(object):
+    """
+    Bitset over an items index space (0..65535 for SBus), with O(1) set/clear/test
+    and fast extraction of the next set index or of a run of consecutive set indexes.
+
+    Bits are stored in 64 bits words, with a summary level (one bit per non-empty word)
+    and a top level (one bit per non-empty summary word), allowing to skip empty areas
+    without scanning them
+    """
+
+    def __init__(self, size=65536):
+        self._size=size
+        self._words=[0]*((size+63) >> 6)
+        self._summary=[0]*((len(self._words)+63) >> 6)
+        self._top=0
+        self._count=0
+
+    @property
+    def size(self):
+        return self._size
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def isEmpty(self):
+        if self._count==0:
+            return True
+        return False
+
+    def test(self, index):
+        try:
+            if self._words[index >> 6] & (1 << (index & 63)):
+                return True
+        except:
+            pass
+        return False
+
+    def __contains__(self, index):
+        return self.test(index)
+
+    def set(self, index):
+        """
+        Set the bit, returning True if it wasn't already set
+        """
+        w=index >> 6
+        bit=1 << (index & 63)
+        word=self._words[w]
+        if word & bit:
+            return False
+        if not word:
+            s=w >> 6
+            if not self._summary[s]:
+                self._top |= (1 << s)
+            self._summary[s] |= (1 << (w & 63))
+        self._words[w]=word | bit
+        self._count+=1
+        return True
+
+    def setRange(self, start, count):
+        """
+        Set the bits [start, start+count), returning the number of bits newly set
+        """
+        end=min(start+count, self._size)
+        index=max(0, start)
+        added=0
+        while index<end:
+            w=index >> 6
+            offset=index & 63
+            n=min(64-offset, end-index)
+            mask=((1 << n)-1) << offset
+            word=self._words[w]
+            new=mask & ~word
+            if new:
+                if not word:
+                    s=w >> 6
+                    if not self._summary[s]:
+                        self._top |= (1 << s)
+                    self._summary[s] |= (1 << (w & 63))
+                self._words[w]=word | mask
+                added+=bin(new).count('1')
+            index+=n
+        self._count+=added
+        return added
+
+    def clear(self, index):
+        """
+        Clear the bit, returning True if it was set
+        """
+        try:
+            w=index >> 6
+            bit=1 << (index & 63)
+            word=self._words[w]
+            if word & bit:
+                word &= ~bit
+                self._words[w]=word
+                self._count-=1
+                if not word:
+                    s=w >> 6
+                    self._summary[s] &= ~(1 << (w & 63))
+                    if not self._summary[s]:
+                        self._top &= ~(1 << s)
+                return True
+        except:
+            pass
+        return False
+
+    def clearAll(self):
+        self._words=[0]*len(self._words)
+        self._summary=[0]*len(self._summary)
+        self._top=0
+        self._count=0
+
+    def _lowest(self, value):
+        return (value & -value).bit_length()-1
+
+    def next(self, start=0):
+        """
+        Return the first set index >= start, or None
+        """
+        if self._count==0 or start>=self._size:
+            return None
+        if start<0:
+            start=0
+
+        w=start >> 6
+        word=self._words[w] >> (start & 63)
+        if word:
+            return start+self._lowest(word)
+
+        # next non empty word in the same summary word
+        w+=1
+        s=w >> 6
+        if s<len(self._summary):
+            summary=self._summary[s] >> (w & 63)
+            if summary:
+                w+=self._lowest(summary)
+                return (w << 6)+self._lowest(self._words[w])
+
+            # next non empty summary word
+            top=self._top >> (s+1)
+            if top:
+                s+=1+self._lowest(top)
+                w=(s << 6)+self._lowest(self._summary[s])
+                return (w << 6)+self._lowest(self._words[w])
+
+        return None
+
+    def nextWrap(self, start=0):
+        """
+        Return the first set index >= start, wrapping around the index space
+        """
+        index=self.next(start)
+        if index is None and start>0:
+            index=self.next(0)
+        return index
+
+    def run(self, start, maxcount):
+        """
+        Return the number of consecutive set indexes from start (up to maxcount)
+        """
+        count=0
+        index=start
+        while count<maxcount and index<self._size:
+            word=self._words[index >> 6] >> (index & 63)
+            if not word & 1:
+                break
+            # count the trailing ones of this word
+            ones=self._lowest(~word)
+            ones=min(ones, 64-(index & 63), maxcount-count)
+            count+=ones
+            index+=ones
+        return count
+
+    def __iter__(self):
+        index=self.next(0)
+        while index is not None:
+            yield index
+            index=self.next(index+1)
+
+    def __repr__(self):
+        return '<%s(size=%d, count=%d)>' % (self.__class__.__name__, self._size, self._count)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,76 @@
+from __future__ import division
+
+from array import array
+
+
+class SAIAChangeLog(object):
+    """
+    Bounded log of changes (integers) numbered by a monotonic generation counter. The last size
+    entries are kept in a ring buffer (preallocated array), the entry of a generation being at
+    its position modulo size, so that the changes since a generation are extracted in O(changes),
+    without consuming them (any number of independent consumers)
+    """
+
+    def __init__(self, size=4096):
+        self._size=max(1, int(size))
+        self._entries=array('q', [0])*self._size
+        self._generation=0
+
+    @property
+    def size(self):
+        return self._size
+
+    def generation(self):
+        return self._generation
+
+    def append(self, entry):
+        """
+        Log a change, returning its generation
+        """
+        self._generation+=1
+        self._entries[self._generation % self._size]=entry
+        return self._generation
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+        return self._generation
+
+    def oldest(self):
+        """
+        Return the oldest generation still in the log
+        """
+        return max(1, self._generation-self._size+1)
+
+    def isCovered(self, generation):
+        """
+        True if the changes after generation are still all in the log
+        """
+        if generation>=self.oldest()-1:
+            return True
+        return False
+
+    def since(self, generation):
+        """
+        Return the entries logged after generation (oldest first), or None if some of them are
+        not in the log anymore (the consumer must then resynchronize)
+        """
+        generation=max(0, generation)
+        if generation>=self._generation:
+            return []
+        if not self.isCovered(generation):
+            return None
+        size=self._size
+        entries=self._entries
+        return [entries[n % size] for n in range(generation+1, self._generation+1)]
+
+    def stats(self):
+        return {'generation': self._generation, 'size': self._size,
+            'entries': min(self._generation, self._size)}
+
+    def __repr__(self):
+        return '<%s(generation=%d, size=%d)>' % (self.__class__.__name__, self._generation, self._size)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,10 +1,16 @@
 from __future__ import print_function  # Python 2/3 compatibility
 
 import time
+import weakref
+import itertools
 from prettytable import PrettyTable
 
 from threading import RLock
 from threading import Event
+from threading import Condition
+from collections import deque
+from bisect import bisect_left
+from operator import attrgetter
 
 from .formaters import SAIAValueFormaterFloat32
 from .formaters import SAIAValueFormaterSwappedFloat32
@@ -12,6 +18,15 @@ from .formaters import SAIAValueFormaterInteger10
 from .formaters import SAIAValueFormaterFFP
 from .formaters import SAIAValueFormater
 
+from .bitmap import SAIAIndexBitmap
+from .planner import SAIAPullPlanner
+from .ranges import SAIAIndexRanges
+from .ranges import SAIAIndexRuns
+from .store import SAIAItemStore
+from .store import SAIAItemView
+from .pages import SAIAItemPages
+from .changelog import SAIAChangeLog
+
 
 class SAIAItemGroup(object):
     def __init__(self, items=None):
@@ -57,31 +72,73 @@ class SAIAItemGroup(object):
 
             self._itemsIndexById[id(item)]=self.count()
             self._items.append(item)
+            try:
+                # the collection removes its undeclared items from the group
+                item.parent.registerGroup(self)
+            except:
+                pass
             return item
 
     def remove(self, item):
         if item:
+            self.removeItems([item])
+
+    def removeItems(self, items):
+        """
+        Remove the given items from the group
+        """
+        ids=set([id(item) for item in items])
+        if ids.intersection(self._itemsIndexById):
+            self._items=[item for item in self._items if id(item) not in ids]
+            self._itemsIndexById=dict([(id(item), n) for (n, item) in enumerate(self._items)])
+
+    def undeclare(self):
+        """
+        Undeclare the items of the group from their collections, emptying the group
+        """
+        count=0
+        for (items, members) in self.collections():
+            for item in members:
+                count+=items.undeclare(item)
+        self._items=[]
+        self._itemsIndexById={}
+        return count
+
+    def collections(self):
+        """
+        Return the group items by collection, as a list of (collection, items)
+        """
+        collections=[]
+        index={}
+        for item in self.all():
+            parent=item.parent
             try:
-                i = self._itemsIndexById.pop(id(item))
-                self._items.pop(i)
-            except:
-                pass
+                collections[index[id(parent)]][1].append(item)
+            except KeyError:
+                index[id(parent)]=len(collections)
+                collections.append((parent, [item]))
+        return collections
 
     def refresh(self, urgent=False):
         if self._items:
             for item in self.all():
                 item.clearUpdated()
-                item.refresh(urgent)
+            # pulls signaled in bulk, each collection planning its frames once for the group
+            for (items, members) in self.collections():
+                items.signalPulls(members, urgent)
+
+    def readAsync(self, timeout=15.0, callback=None):
+        """
+        Start a read of the group items and return its completion (SAIAItemGroupRead)
+        without waiting. The optional callback(read) is called when the read is done
+        """
+        read=SAIAItemGroupRead(self.all(), timeout, callback)
+        read.start()
+        return read
 
     def read(self, timeout=15.0):
         if self._items:
-            timeout=time.time()+timeout
-            self.refresh(True)
-            for item in self.all():
-                t=timeout-time.time()
-                if t<0 or not item.waitUpdated(t):
-                    return False
-            return True
+            return self.readAsync(timeout).wait()
 
     def isRaised(self, reset=True):
         if self._items:
@@ -143,24 +200,257 @@ class SAIAItemGroup(object):
         return '<%s(%d items)>' % (self.__class__.__name__, self.count())
 
 
+class SAIAItemRange(object):
+    """
+    Lazy sequence of the items of a declared range (see SAIAItems.declareRange), the items
+    objects being created on demand when accessed
+    """
+
+    def __init__(self, parent, index, count):
+        self._parent=parent
+        self._index=index
+        self._count=count
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @property
+    def index(self):
+        return self._index
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[n] for n in range(*key.indices(self._count))]
+        if key<0:
+            key+=self._count
+        if key<0 or key>=self._count:
+            raise IndexError(key)
+        return self._parent.item(self._index+key)
+
+    def __iter__(self):
+        for n in range(self._count):
+            yield self._parent.item(self._index+n)
+
+    def __repr__(self):
+        return '<%s(%s, index=%d, count=%d)>' % (self.__class__.__name__,
+            self._parent.__class__.__name__, self._index, self._count)
+
+
+class SAIAItemSelection(object):
+    """
+    Lazy sequence of the items of a selection of declared indexes (see SAIAItems.alive), the
+    items objects being created on demand when accessed
+    """
+
+    def __init__(self, parent, indexes):
+        self._parent=parent
+        self._indexes=indexes
+
+    @property
+    def parent(self):
+        return self._parent
+
+    def indexes(self):
+        return self._indexes
+
+    def count(self):
+        return len(self._indexes)
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._parent.item(index) for index in self._indexes[key]]
+        return self._parent.item(self._indexes[key])
+
+    def __iter__(self):
+        for index in self._indexes:
+            yield self._parent.item(index)
+
+    def __repr__(self):
+        return '<%s(%s, count=%d)>' % (self.__class__.__name__,
+            self._parent.__class__.__name__, len(self._indexes))
+
+
+class SAIAItemGroupRead(object):
+    """
+    Completion of a group read (see SAIAItemGroup.readAsync()). The urgent pulls are signaled
+    in bulk per collection, so that each server plans the minimal frames covering its part of the
+    group, and the servers links are served concurrently by the node. An item succeeds when a
+    value is received after the start of the read, and fails when rejected by the server or not
+    received before the timeout
+    """
+
+    def __init__(self, items, timeout=15.0, callback=None):
+        self._items=list(items)
+        self._lock=RLock()
+        self._eventDone=Event()
+        self._delayTimeout=timeout
+        self._timeout=0
+        self._stamp=0
+        self._callback=callback
+        self._collections=[]
+        self._pending={}
+        self._failed={}
+
+    @property
+    def logger(self):
+        try:
+            return self._items[0].logger
+        except:
+            pass
+
+    def start(self):
+        self._stamp=time.time()
+        self._timeout=self._stamp+self._delayTimeout
+        with self._lock:
+            for item in self._items:
+                # local items are not pulled
+                if not item.parent.isLocalNodeMode():
+                    item.clearUpdated()
+                    self._pending[id(item)]=item
+        collections=SAIAItemGroup(list(self._pending.values())).collections()
+        self._collections=[items for (items, members) in collections]
+        for items in self._collections:
+            items.registerGroupRead(self)
+        for (items, members) in collections:
+            items.signalPulls(members, urgent=True)
+        self.checkDone()
+
+    def onItemsUpdated(self, items):
+        if self._pending:
+            with self._lock:
+                for item in items:
+                    self._pending.pop(id(item), None)
+            self.checkDone()
+
+    def onItemFailed(self, item):
+        with self._lock:
+            if self._pending.pop(id(item), None) is not None:
+                self._failed[id(item)]=item
+        self.checkDone()
+
+    def checkDone(self):
+        """
+        Complete the read when every item is done, or on timeout (the remaining items failing)
+        """
+        with self._lock:
+            if self._eventDone.isSet():
+                return True
+            if self._pending and time.time()<self._timeout:
+                return False
+            self._failed.update(self._pending)
+            self._pending={}
+            self._eventDone.set()
+
+        for items in self._collections:
+            items.unregisterGroupRead(self)
+        if self._callback:
+            try:
+                self._callback(self)
+            except:
+                self.logger.exception('group read callback')
+        return True
+
+    def isDone(self):
+        return self.checkDone()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the read completion (at most timeout seconds if given) and return the result
+        """
+        if timeout is not None:
+            timeout=time.time()+timeout
+        while not self.checkDone():
+            delay=self._timeout-time.time()
+            if timeout is not None:
+                delay=min(delay, timeout-time.time())
+                if delay<=0:
+                    break
+            self._eventDone.wait(max(0.01, min(delay, 1.0)))
+        return self.result()
+
+    def result(self):
+        """
+        True if every item has been read, False if any has failed, None while not done
+        """
+        if self._eventDone.isSet():
+            if self._failed:
+                return False
+            return True
+
+    def isItemSuccess(self, item):
+        if self._eventDone.isSet() and id(item) not in self._failed:
+            return True
+        return False
+
+    def succeeded(self):
+        return [item for item in self._items if self.isItemSuccess(item)]
+
+    def failed(self):
+        with self._lock:
+            return list(self._failed.values())
+
+    def age(self):
+        return time.time()-self._stamp
+
+    def __repr__(self):
+        with self._lock:
+            return '<%s(%d items, pending=%d, failed=%d, done=%s)>' % (self.__class__.__name__,
+                len(self._items), len(self._pending), len(self._failed), self._eventDone.isSet())
+
+
 class SAIAItem(object):
+
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+
+    # state flags (same bits as the item store flags)
+    FLAG_RAISED = SAIAItemStore.FLAG_RAISED
+    FLAG_CHANGED = SAIAItemStore.FLAG_CHANGED
+    FLAG_UPDATED = SAIAItemStore.FLAG_UPDATED
+    FLAG_VALUE = SAIAItemStore.FLAG_VALUE
+
+    __slots__ = ('_parent', '_index', '_value', '_pushValue', '_stamp', '_stampPull', '_stampPush',
+        '_inhibitTimeout', '_readOnly', '_delayRefresh', '_adaptiveRefresh', '_delayRefreshMin',
+        '_delayRefreshMax', '_delayAdaptive', '_stampChanged', '_periodChange', '_priority', '_flags', '_sample',
+        '_snapshot')
+
     def __init__(self, parent, index, value=0, delayRefresh=None, readOnly=False):
         self._parent=parent
         self._index=index
         self._value=self.validateValue(value)
         self._pushValue=None
         self._stamp=0
+        # (value, stamp) pair published at once by each update (see snapshot)
+        self._snapshot=(self._value, 0)
+        self._sample=0
+        self._stampPull=0
+        self._stampPush=0
         self._inhibitTimeout=0
         self._readOnly=readOnly
         self._delayRefresh=delayRefresh
-        self._eventPush=Event()
-        self._eventPull=Event()
-        self._eventValue=Event()
-        self._eventRaised=Event()
-        self._eventChanged=Event()
-        self._eventUpdated=Event()
+        self._adaptiveRefresh=None
+        self._delayRefreshMin=None
+        self._delayRefreshMax=None
+        self._delayAdaptive=None
+        self._stampChanged=0
+        self._periodChange=None
+        self._priority=None
+        # raised, changed, updated and value received flags (see waitFlags)
+        self._flags=0
         self.onInit()
-        self.logger.debug('%s->creating %s' % (self.server.host, self))
+        # lazy formatting, the item repr is costly (symbols lookup)
+        self.logger.debug('%s->creating %s', self.server.host, self)
 
     @property
     def parent(self):
@@ -215,8 +505,9 @@ class SAIAItem(object):
 
     def setRefreshDelay(self, delay):
         self._delayRefresh=delay
+        self._delayAdaptive=None
 
-    def getRefreshDelay(self):
+    def getNominalRefreshDelay(self):
         try:
             if self._delayRefresh is not None:
                 return self._delayRefresh
@@ -224,7 +515,101 @@ class SAIAItem(object):
         except:
             return 60
 
-    def validateValue(self, value):
+    def getRefreshDelay(self):
+        delay=self.getNominalRefreshDelay()
+        if self._delayAdaptive is not None and self.isAdaptiveRefresh():
+            delay=self._delayAdaptive
+        return delay*self.getShedFactor()
+
+    def setPriority(self, priority):
+        """
+        Polling priority (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW) used by the load shedding policy
+        """
+        self._priority=priority
+
+    def getPriority(self):
+        if self._priority is not None:
+            return self._priority
+        try:
+            return self.parent.getPriority()
+        except:
+            return SAIAItem.PRIORITY_NORMAL
+
+    def getShedFactor(self):
+        try:
+            return self.memory.scheduler.getShedFactor(self.getPriority())
+        except:
+            return 1.0
+
+    def setAdaptiveRefresh(self, state=True, delayMin=None, delayMax=None):
+        """
+        Enable (or disable) the change-rate adaptive refresh for this item, overriding
+        the collection setting. delayMin/delayMax bound the learned refresh delay
+        """
+        self._adaptiveRefresh=bool(state)
+        if delayMin is not None:
+            self._delayRefreshMin=delayMin
+        if delayMax is not None:
+            self._delayRefreshMax=delayMax
+        self._delayAdaptive=None
+
+    def isAdaptiveRefresh(self):
+        if self._adaptiveRefresh is not None:
+            return self._adaptiveRefresh
+        try:
+            return self.parent.isAdaptiveRefresh()
+        except:
+            return False
+
+    def getAdaptiveRefreshBounds(self):
+        delay=self.getNominalRefreshDelay()
+        (delayMin, delayMax)=self.parent.getAdaptiveRefreshBounds()
+        if self._delayRefreshMin is not None:
+            delayMin=self._delayRefreshMin
+        if self._delayRefreshMax is not None:
+            delayMax=self._delayRefreshMax
+        if delayMin is None:
+            delayMin=delay
+        if delayMax is None:
+            delayMax=delay*10.0
+        return (delayMin, max(delayMin, delayMax))
+
+    def updateAdaptiveRefresh(self, changed):
+        """
+        Learn the item change rate from the polled values : the refresh delay is backed off
+        while the value stays constant, and tightened again as soon as changes appear
+        (never slower than half the observed change period)
+        """
+        if not self.isAdaptiveRefresh():
+            return
+
+        (delayMin, delayMax)=self.getAdaptiveRefreshBounds()
+        delay=self._delayAdaptive
+        if delay is None:
+            delay=self.getNominalRefreshDelay()
+
+        if changed:
+            now=time.time()
+            if self._stampChanged>0:
+                period=now-self._stampChanged
+                if self._periodChange is None:
+                    self._periodChange=period
+                else:
+                    self._periodChange=0.7*self._periodChange+0.3*period
+            self._stampChanged=now
+            delay=delay/2.0
+            if self._periodChange is not None:
+                delay=min(delay, self._periodChange/2.0)
+        else:
+            delay=delay*1.5
+
+        self._delayAdaptive=min(max(delay, delayMin), delayMax)
+
+    def getChangePeriod(self):
+        return self._periodChange
+
+    @classmethod
+    def validateValue(cls, value):
         return value
 
     def setReadOnly(self, state=True):
@@ -235,58 +620,126 @@ class SAIAItem(object):
             return True
         return False
 
+    def isDeclared(self):
+        """
+        False once the item has been undeclared from its collection
+        """
+        if self._parent._pages.get(self._index) is self:
+            return True
+        return False
+
+    def undeclare(self):
+        return self._parent.undeclare(self)
+
     def signalPush(self, value):
+        if not self.isDeclared():
+            return
         if self.parent.isLocalNodeMode():
             self.setValue(value)
         else:
-            if not self._eventPush.isSet():
-                self._eventPush.set()
-                self._parent.signalPush(self)
             with self._parent._lock:
                 self._pushValue=value
+                if not self.isPendingPushRequest():
+                    self._stampPush=time.time()
+                self._parent.signalPush(self)
 
     def isPendingPushRequest(self):
-        if self._eventPush.isSet():
-            return True
-        return False
+        return self._parent.isPendingPush(self.index)
 
     def clearPush(self):
-        self._eventPush.clear()
+        self._parent.clearPush(self.index)
 
     def signalPull(self, urgent=False):
-        if not self.parent.isLocalNodeMode():
-            if not self._eventPull.isSet():
-                self._eventPull.set()
-                self._eventValue.clear()
+        if not self.parent.isLocalNodeMode() and self.isDeclared():
+            with self._parent._lock:
+                if not self.isPendingPullRequest():
+                    self._stampPull=time.time()
+                    self._flags &= ~SAIAItem.FLAG_VALUE
                 self._parent.signalPull(self, urgent)
 
     def clearPull(self):
-        self._eventPull.clear()
+        self._parent.clearPull(self.index)
 
     def isPendingPullRequest(self):
-        if self._eventPull.isSet():
-            return True
-        return False
+        return self._parent.isPendingPull(self.index)
 
-    def setValue(self, value, force=False):
+    def setValue(self, value, force=False, learn=True):
         # we must be able to setValue from a readItemResponse
+        # learn=False for values not coming from the server (i.e. trusted write), not feeding the adaptive refresh
         if value is not None and (force or not self.isReadOnly()):
             value=self.validateValue(value)
+            parent=self._parent
+            with parent._lock:
+                (raised, changed)=self.updateValue(value, learn)
+                if changed:
+                    parent.logChanges([self._index])
+                parent.notifyWaiters()
+
+    def updateValue(self, value, learn=True, stamp=None, sample=0, publish=True):
+        """
+        Store the (validated) value and update the state flags, the caller holding the collection
+        lock (and notifying the waiters, see SAIAItems.notifyWaiters). sample is the id of the
+        response frame of the value (0 if not received from the server). Unless publish, the caller
+        publishes the (value, stamp) pair (see SAIAItems.ingest). Return (raised, changed)
+        """
+        raised=False
+        changed=False
+        flags=SAIAItem.FLAG_UPDATED | SAIAItem.FLAG_VALUE
+        localNodeMode=self._parent._localNodeMode
+        # only if we have already received a value
+        if self._stamp>0 or localNodeMode:
+            if not self._value and value:
+                raised=True
+                flags |= SAIAItem.FLAG_RAISED
+            if value!=self._value:
+                changed=True
+                flags |= SAIAItem.FLAG_CHANGED
+            if learn and self._stamp>0 and not localNodeMode:
+                self.updateAdaptiveRefresh(changed)
+        if stamp is None:
+            stamp=time.time()
+        self._stamp=stamp
+        self._sample=sample
+        self._value=value
+        if publish:
+            self._snapshot=(value, stamp)
+        self._flags |= flags
+        return (raised, changed)
+
+    def testFlags(self, flags, reset=False):
+        """
+        Return the given state flags, clearing them if reset
+        """
+        state=self._flags & flags
+        if state and reset:
             with self._parent._lock:
-                # only if we have already received a value
-                if self._stamp>0 or self.server.isLocalNodeMode():
-                    if not self._value and value:
-                        self._eventRaised.set()
-                    if value!=self._value:
-                        self._eventChanged.set()
-                self._stamp=time.time()
-                self._value=value
-            self._eventValue.set()
-            self._eventUpdated.set()
+                self._flags &= ~flags
+        return state
+
+    def waitFlags(self, flags, timeout=None):
+        return self._parent.waitItemFlags(self, flags, timeout)
 
     def getValue(self):
-        with self._parent._lock:
-            return self._value
+        # lock-free, a single attribute read being atomic (see snapshot for the timestamp)
+        return self._value
+
+    def getSample(self):
+        """
+        Return the id of the response frame of the value : values with the same sample id were read
+        together (same frame, same timestamp). 0 if the value was not received from the server
+        """
+        return self._sample
+
+    @property
+    def sample(self):
+        return self.getSample()
+
+    def snapshot(self):
+        """
+        Return a consistent (value, stamp) pair, without lock (the pair is immutable and replaced
+        at once by each update)
+        """
+        return self._snapshot
 
     @property
     def value(self):
@@ -301,34 +754,26 @@ class SAIAItem(object):
                     self.signalPush(value)
 
     def isRaised(self, reset=True):
-        raised=self._eventRaised.isSet()
-        if raised and reset:
-            self._eventRaised.clear()
-        return raised
+        if self.testFlags(SAIAItem.FLAG_RAISED, reset):
+            return True
+        return False
 
     def isChanged(self, reset=True):
-        changed=self._eventChanged.isSet()
-        if changed and reset:
-            self._eventChanged.clear()
-        return changed
+        if self.testFlags(SAIAItem.FLAG_CHANGED, reset):
+            return True
+        return False
 
     def isUpdated(self, reset=True):
-        if self._eventUpdated.isSet():
-            if reset:
-                self.clearUpdated()
+        if self.testFlags(SAIAItem.FLAG_UPDATED, reset):
             return True
         return False
 
     def clearUpdated(self):
-        self._eventUpdated.clear()
+        with self._parent._lock:
+            self._flags &= ~SAIAItem.FLAG_UPDATED
 
     def waitUpdated(self, timeout=3.0):
-        try:
-            self._eventUpdated.wait(timeout)
-            return True
-        except:
-            pass
-        return False
+        return self.waitFlags(SAIAItem.FLAG_UPDATED, timeout)
 
     @property
     def bool(self):
@@ -342,8 +787,7 @@ class SAIAItem(object):
             return self._pushValue
 
     def age(self):
-        with self._parent._lock:
-            return time.time()-self._stamp
+        return time.time()-self._stamp
 
     def isAlive(self, maxAge=None):
         if self.server.isAlive():
@@ -379,7 +823,7 @@ class SAIAItem(object):
         try:
             if timeout<=0:
                 timeout=None
-            self._eventValue.wait(timeout)
+            self.waitFlags(SAIAItem.FLAG_VALUE, timeout)
             return self.value
         except:
             pass
@@ -399,16 +843,23 @@ class SAIAItem(object):
     def tag(self):
         return None
 
+    def strRefresh(self):
+        refresh='%.01fs' % self.getRefreshDelay()
+        if self.isAdaptiveRefresh():
+            (delayMin, delayMax)=self.getAdaptiveRefreshBounds()
+            refresh+='[adaptive %.01f..%.01fs]' % (delayMin, delayMax)
+        return refresh
+
     def __repr__(self):
         tag=self.tag
-        raised=self._eventRaised.isSet()
-        changed=self._eventChanged.isSet()
+        raised=bool(self._flags & SAIAItem.FLAG_RAISED)
+        changed=bool(self._flags & SAIAItem.FLAG_CHANGED)
         if tag:
-            return '<%s(index=%d, tag=%s, value=%s, age=%ds, refresh=%.01fs, alive=%d, raised=%d, changed=%d)>' % (self.__class__.__name__,
-                self.index, tag, self.strValue(), self.age(), self.getRefreshDelay(), self.isAlive(), raised, changed)
+            return '<%s(index=%d, tag=%s, value=%s, age=%ds, refresh=%s, alive=%d, raised=%d, changed=%d)>' % (self.__class__.__name__,
+                self.index, tag, self.strValue(), self.age(), self.strRefresh(), self.isAlive(), raised, changed)
         else:
-            return '<%s(index=%d, value=%s, age=%ds, refresh=%.01fs, alive=%d, raised=%d, changed=%d)>' % (self.__class__.__name__,
-                self.index, self.strValue(), self.age(), self.getRefreshDelay(), self.isAlive(), raised, changed)
+            return '<%s(index=%d, value=%s, age=%ds, refresh=%s, alive=%d, raised=%d, changed=%d)>' % (self.__class__.__name__,
+                self.index, self.strValue(), self.age(), self.strRefresh(), self.isAlive(), raised, changed)
 
     @property
     def formatedvalue(self):
@@ -420,7 +871,10 @@ class SAIAItem(object):
 
 
 class SAIABooleanItem(SAIAItem):
-    def validateValue(self, value):
+    __slots__ = ()
+
+    @classmethod
+    def validateValue(cls, value):
         try:
             return bool(value)
         except:
@@ -462,11 +916,14 @@ class SAIABooleanItem(SAIAItem):
 
 
 class SAIAAnalogItem(SAIAItem):
+    __slots__ = ('_formater',)
+
     def onInit(self):
         super(SAIAAnalogItem, self).onInit()
         self._formater=None
 
-    def validateValue(self, value):
+    @classmethod
+    def validateValue(cls, value):
         try:
             if type(value)==float:
                 formater=SAIAValueFormaterFFP()
@@ -587,19 +1044,71 @@ class SAIAAnalogItem(SAIAItem):
 
 
 class SAIAItems(object):
+
+    # max items per read request (frame packing limit)
+    PULL_MAXCOUNT = 1
+    # size of an item in a read response (bytes), used by the read planner
+    PULL_ITEMCOST = 4.0
+    # values array type of the (optional) columnar store
+    STORE_TYPECODE = 'q'
+    # response frames (samples) ids, shared by every collection
+    _sampleIds = itertools.count(1)
+    # changes kept in the collection change log (see changesSince)
+    CHANGELOG_SIZE = 4096
+    # rejected read frames whose failing index is being searched (see onPullRejected)
+    SUSPECTS_MAXCOUNT = 64
+
     def __init__(self, memory, itemType, maxsize, readOnly=False):
         assert memory.__class__.__name__=='SAIAMemory'
         self._memory=memory
         self._localNodeMode=memory.isLocalNodeMode()
         self._lock=RLock()
+        # shared by the items blocking waits (read, waitUpdated)
+        self._condition=Condition(self._lock)
+        self._waiters=0
+        # values changes log, numbered by the collection generation
+        self._changes=SAIAChangeLog(self.CHANGELOG_SIZE)
         self._itemType=itemType
         self._maxsize=maxsize
         self._readOnly=readOnly
-        self._items=[]
-        self._indexItem={}
-        self._timeoutSort=0
+        # declared items by index (sparse pages)
+        self._pages=SAIAItemPages(maxsize)
+        # sorted runs of the declared indexes (with or without item)
+        self._declared=SAIAIndexRuns()
+        # pending requests (push, urgent and background pull) bitsets over the index space
+        self._pendingPush=SAIAIndexBitmap(maxsize)
+        self._pendingPriorityPull=SAIAIndexBitmap(maxsize)
+        self._pendingPull=SAIAIndexBitmap(maxsize)
+        self._cursorPush=0
+        self._stampPushFirst=0
+        self._stampPushLast=0
+        # planned read frames (index, count) covering the pending pulls
+        self._planner=SAIAPullPlanner(self.PULL_MAXCOUNT, self.PULL_ITEMCOST)
+        # learned readable/failing index ranges (holes bridging)
+        self._ranges=SAIAIndexRanges()
+        # rejected frames [start, end, declared indexes not yet read alone, failing indexes]
+        self._suspects=deque(maxlen=self.SUSPECTS_MAXCOUNT)
+        self._planPriorityPull=deque()
+        self._planPriorityPullDirty=False
+        self._planPull=deque()
+        self._framePull=None
+        # in-flight read request, and pulls coalesced with it
+        self._inflightPull=None
+        self._countCoalesced=0
+        # group reads (SAIAItemGroupRead) waiting for items of the collection
+        self._groupReads=[]
+        # groups (SAIAItemGroup) referencing items of the collection
+        self._groups=weakref.WeakSet()
+        # optional columnar store (see enableStore), enabled by the lazy range declarations
+        self._store=None
+        self._lazyRanges=True
+        self._cursorStore=0
         self._currentItem=0
         self._delayRefresh=60
+        self._adaptiveRefresh=False
+        self._delayRefreshMin=None
+        self._delayRefreshMax=None
+        self._priority=SAIAItem.PRIORITY_NORMAL
 
     @property
     def memory(self):
@@ -630,9 +1139,62 @@ class SAIAItems(object):
     def getRefreshDelay(self):
         return self._delayRefresh
 
+    def setAdaptiveRefresh(self, state=True, delayMin=None, delayMax=None):
+        """
+        Enable (or disable) the change-rate adaptive refresh for every item of the collection.
+        Unless given, delayMin defaults to the item refresh delay and delayMax to 10x this delay
+        """
+        self._adaptiveRefresh=bool(state)
+        if delayMin is not None:
+            self._delayRefreshMin=delayMin
+        if delayMax is not None:
+            self._delayRefreshMax=delayMax
+
+    def isAdaptiveRefresh(self):
+        if self._adaptiveRefresh:
+            return True
+        return False
+
+    def getAdaptiveRefreshBounds(self):
+        return (self._delayRefreshMin, self._delayRefreshMax)
+
+    def setPriority(self, priority):
+        self._priority=priority
+
+    def getPriority(self):
+        return self._priority
+
+    def enableStore(self):
+        """
+        Keep the items state in a columnar store (typed arrays indexed by address), items objects
+        being created on demand. Items already declared are registered in the store but keep
+        their own state
+        """
+        with self._lock:
+            if self._store is None:
+                store=SAIAItemStore(self._maxsize, self.STORE_TYPECODE)
+                for item in self._pages:
+                    store.declare(item.index)
+                    store.setItem(item.index)
+                self._store=store
+            return True
+
+    @property
+    def itemType(self):
+        return self._itemType
+
+    def isStore(self):
+        if self._store is not None:
+            return True
+        return False
+
+    @property
+    def store(self):
+        return self._store
+
     def count(self):
         with self._lock:
-            return len(self._items)
+            return self._declared.count()
 
     def resolveIndex(self, index):
         """
@@ -641,6 +1203,13 @@ class SAIAItems(object):
         """
         return None
 
+    def resolveTag(self, index):
+        """
+        Provide an index to name (tag) resolution mecanism, for the indexes without item
+        Must be implemented by subclass if needed
+        """
+        return None
+
     def validateIndex(self, index):
         try:
             try:
@@ -662,29 +1231,132 @@ class SAIAItems(object):
         return False
 
     def all(self):
-        return self._items
+        """
+        Return the items objects of the collection. The indexes declared in the store without
+        item are not materialized (see alive, dead, active and snapshot)
+        """
+        return self._pages.items()
 
-    def alive(self, maxAge=None):
+    def select(self, test, indexes):
+        """
+        Return the lazy sequence (SAIAItemSelection) of the items passing test and of the given
+        indexes without item (selected in the store)
+        """
         with self._lock:
-            return [item for item in self.all() if item.isAlive(maxAge)]
+            items=[item.index for item in self._pages if test(item)]
+        if indexes:
+            items=sorted(items+indexes)
+        return SAIAItemSelection(self, items)
+
+    def selectAge(self, maxAge=None, alive=True):
+        indexes=[]
+        if self._store is not None:
+            if not self.server.isAlive():
+                if not alive:
+                    indexes=self._store.indexes(False)
+            else:
+                if maxAge is None:
+                    maxAge=max(self.getStoreRefreshDelay()*1.5, 15.0)
+                indexes=self._store.aged(time.time()-maxAge, alive)
+        return self.select(lambda item: item.isAlive(maxAge)==alive, indexes)
+
+    def alive(self, maxAge=None):
+        return self.selectAge(maxAge, True)
 
     def dead(self, maxAge=None):
-        with self._lock:
-            return [item for item in self.all() if not item.isAlive(maxAge)]
+        return self.selectAge(maxAge, False)
 
     def __iter__(self):
         return iter(self.all())
 
     def active(self):
-        return [item for item in self.all() if item.value]
+        indexes=[]
+        if self._store is not None:
+            indexes=self._store.nonzero()
+        return self.select(lambda item: item.value, indexes)
 
     def item(self, index):
         try:
             with self._lock:
-                return self._indexItem[self.validateIndex(index)]
+                index=self.validateIndex(index)
+                item=self._pages.get(index)
+                if item is None and self._store is not None and self._store.isDeclared(index):
+                    return self.materialize(index)
+                return item
         except:
             pass
 
+    def materialize(self, index):
+        """
+        Create the item (view) of an index declared in the store
+        """
+        with self._lock:
+            store=self._store
+            stamp=store.getStamp(index)
+            sample=store.getSample(index)
+            flags=store.testFlags(index, 0xff)
+            snapshot=store.getSnapshot(index)
+            item=store.viewClass(self._itemType)(self, index, store.getValue(index))
+            # the item state flags are the store flags
+            item._stamp=stamp
+            item._sample=sample
+            item._flags=flags
+            item._snapshot=snapshot
+            store.setItem(index)
+            self._pages.set(index, item)
+            return item
+
+    def frameItem(self, index):
+        """
+        Transient item (not registered in the collection) of a store index without item, heading
+        a read frame : the read request only needs its index, the values being ingested by index
+        """
+        store=self._store
+        item=self._itemType(self, index, store.getValue(index))
+        item._stamp=store.getStamp(index)
+        return item
+
+    def isIndexDeclared(self, index):
+        if index in self._pages:
+            return True
+        if self._store is not None:
+            return self._store.isDeclared(index)
+        return False
+
+    def countDeclaredRun(self, index, maxcount):
+        """
+        Number of consecutive declared indexes from index (at most maxcount)
+        """
+        with self._lock:
+            return self._declared.run(index, maxcount)
+
+    def lastDeclaredIndex(self, index, count):
+        """
+        Return the last declared index in [index, index+count) (or None)
+        """
+        with self._lock:
+            return self._declared.last(index, index+count)
+
+    def nextDeclaredIndex(self, index):
+        """
+        Return the first declared index >= index (or None)
+        """
+        with self._lock:
+            return self._declared.next(index)
+
+    def indexes(self, start=0, end=None):
+        """
+        Return the declared indexes in [start, end), sorted
+        """
+        with self._lock:
+            return list(self._declared.iterRange(start, end))
+
+    def itemsInRange(self, start, end):
+        """
+        Return the items of the declared indexes in [start, end), sorted by index
+        """
+        return [self.item(index) for index in self.indexes(start, end)]
+
     def isItemDeclared(self, index):
         if self.item(index):
             return True
@@ -710,12 +1382,16 @@ class SAIAItems(object):
             if item:
                 return item
 
-            item=self._itemType(self, index, value)
-            # item.setReadOnly(self._readOnly)
             with self._lock:
-                self._items.append(item)
-                self._indexItem[index]=item
-                self._timeoutSort=time.time()+10.0
+                itemType=self._itemType
+                if self._store is not None:
+                    self._store.declare(index)
+                    self._store.setItem(index)
+                    itemType=self._store.viewClass(itemType)
+                item=itemType(self, index, value)
+                # item.setReadOnly(self._readOnly)
+                self._pages.set(index, item)
+                self._declared.add(index)
                 item.signalPull()
                 return item
 
@@ -728,12 +1404,175 @@ class SAIAItems(object):
         return items
 
     def declareRange(self, index, count, value=0):
+        """
+        Declare the items [index, index+count). The range is registered for polling and storage
+        only (see declareIndexes), and a lazy sequence of its items is returned (SAIAItemRange),
+        the items objects being created the first time they are accessed
+        """
+        if not self._lazyRanges:
+            with self._lock:
+                items=[]
+                for n in range(count):
+                    item=self.declare(index+n, value)
+                    items.append(item)
+                return items
+
+        index=self.validateIndex(index)
+        if index is None:
+            return []
+        count=max(0, min(count, self._maxsize-index))
+        self.declareIndexes(index, count, self.validateItemValue(value))
+        return SAIAItemRange(self, index, count)
+
+    def validateItemValue(self, value):
+        """
+        Validate a value for the items of the collection (see SAIAItem.validateValue)
+        """
+        return self._itemType.validateValue(value)
+
+    def indexRuns(self, indexes):
+        """
+        Return the sorted runs (index, count) of the valid indexes given as a range, a list of
+        ranges or a list (array) of indexes
+        """
+        if isinstance(indexes, range) and indexes.step==1:
+            start=max(0, indexes.start)
+            stop=min(indexes.stop, self._maxsize)
+            if stop>start:
+                return [(start, stop-start)]
+            return []
+
+        values=[]
+        for index in indexes:
+            if isinstance(index, range):
+                values.extend(index)
+            else:
+                values.append(index)
+        try:
+            values=sorted(set(map(int, values)))
+        except:
+            # tags (or invalid indexes)
+            values=sorted(set([n for n in map(self.validateIndex, values) if n is not None]))
+        values=values[bisect_left(values, 0):bisect_left(values, self._maxsize)]
+
+        runs=[]
+        for index in values:
+            if runs and runs[-1][0]+runs[-1][1]==index:
+                runs[-1][1]+=1
+            else:
+                runs.append([index, 1])
+        return [(index, count) for (index, count) in runs]
+
+    def declareBulk(self, indexes, value=0):
+        """
+        Declare many indexes at once (a range, a list of ranges or a list/array of indexes) without
+        creating their items (created on demand, as for declareRange). The indexes are validated and
+        merged into runs, registered in the item store and their pulls signaled in bulk, under
+        a single lock acquisition. Return the number of new indexes
+        """
+        runs=self.indexRuns(indexes)
+        value=self.validateItemValue(value)
+        declared=0
         with self._lock:
-            items=[]
-            for n in range(count):
-                item=self.declare(index+n, value)
-                items.append(item)
-            return items
+            for (index, count) in runs:
+                declared+=self.declareIndexes(index, count, value)
+        return declared
+
+    def declareIndexes(self, index, count=1, value=0):
+        """
+        Declare the indexes [index, index+count) in the item store (enabled if needed), without
+        creating their items (created on demand by item()). Return the number of new indexes
+        """
+        index=self.validateIndex(index)
+        if index is None:
+            return 0
+        count=max(0, min(count, self._maxsize-index))
+        with self._lock:
+            self.enableStore()
+            declared=self._store.declare(index, count, value)
+            self._declared.add(index, count)
+            if declared>0 and not self._localNodeMode:
+                # background pulls of the whole range, except the already urgent ones
+                self._pendingPull.setRange(index, count)
+                n=self._pendingPriorityPull.next(index)
+                while n is not None and n<index+count:
+                    self._pendingPull.clear(n)
+                    n=self._pendingPriorityPull.next(n+1)
+            return declared
+
+    def undeclare(self, index, count=1):
+        """
+        Undeclare the indexes [index, index+count), or the given item, item range (SAIAItemRange)
+        or range of indexes. Their items are released from the collection (detached from the store),
+        their pending requests cancelled, the waiting group reads failed and the items removed from
+        the groups. Return the number of undeclared indexes
+        """
+        if isinstance(index, SAIAItem):
+            if index.parent is not self or not index.isDeclared():
+                return 0
+            (index, count)=(index.index, 1)
+        elif isinstance(index, SAIAItemRange):
+            (index, count)=(index.index, index.count())
+        elif isinstance(index, range):
+            return sum([self.undeclare(start, n) for (start, n) in self.indexRuns(index)])
+        else:
+            index=self.validateIndex(index)
+            if index is None:
+                return 0
+        count=max(0, min(count, self._maxsize-index))
+
+        removed=[]
+        undeclared=0
+        with self._lock:
+            for (start, n) in self._declared.runs(index, index+count):
+                for i in range(start, start+n):
+                    item=self._pages.remove(i)
+                    if item is not None:
+                        self.detachItem(item)
+                        removed.append(item)
+                    self._pendingPush.clear(i)
+                    self._pendingPriorityPull.clear(i)
+                    self._pendingPull.clear(i)
+                if self._store is not None:
+                    self._store.undeclare(start, n)
+                undeclared+=self._declared.remove(start, n)
+            if undeclared>0 and self._store is not None:
+                self._store.trim()
+            groups=list(self._groups)
+            reads=list(self._groupReads)
+
+        if removed:
+            for group in groups:
+                group.removeItems(removed)
+            for read in reads:
+                for item in removed:
+                    read.onItemFailed(item)
+        return undeclared
+
+    def undeclareAll(self):
+        return self.undeclare(0, self._maxsize)
+
+    def detachItem(self, item):
+        """
+        Give back to an (undeclared) item view its own state, copied from the store
+        """
+        if self._store is not None and isinstance(item, SAIAItemView):
+            value=item._value
+            stamp=item._stamp
+            sample=item._sample
+            snapshot=item._snapshot
+            mask=SAIAItemStore.FLAG_DECLARED | SAIAItemStore.FLAG_ITEM
+            flags=item._flags & ~mask & 0xff
+            item.__class__=self._itemType
+            item._value=value
+            item._stamp=stamp
+            item._sample=sample
+            item._flags=flags
+            item._snapshot=snapshot
+
+    def registerGroup(self, group):
+        with self._lock:
+            self._groups.add(group)
 
     def declareFromTo(self, indexFrom, indexTo, value=0):
         count=abs(indexTo-indexFrom)+1
@@ -752,47 +1591,588 @@ class SAIAItems(object):
         return items
 
     def signalPush(self, item):
-        self.memory._queuePendingPush.put(item)
+        with self._lock:
+            now=time.time()
+            if self._pendingPush.isEmpty():
+                self._stampPushFirst=now
+            self._stampPushLast=now
+            return self._pendingPush.set(item.index)
+
+    def isPushReady(self, delay=0):
+        """
+        Write combining : pending pushes are held until no new push was signaled for delay seconds
+        (or the oldest one is waiting for 4*delay, or a full write frame is pending)
+        """
+        with self._lock:
+            count=self._pendingPush.count()
+            if count>0:
+                if delay<=0 or count>=self.PULL_MAXCOUNT:
+                    return True
+                now=time.time()
+                if now-self._stampPushLast>=delay or now-self._stampPushFirst>=4*delay:
+                    return True
+        return False
+
+    def getPushHoldDelay(self, delay=0):
+        """
+        Time left (seconds) before the pending pushes are ready (see isPushReady), 0 if they are
+        ready, or None if no push is pending
+        """
+        with self._lock:
+            count=self._pendingPush.count()
+            if count>0:
+                if delay<=0 or count>=self.PULL_MAXCOUNT:
+                    return 0
+                now=time.time()
+                return max(0, min(self._stampPushLast+delay-now, self._stampPushFirst+4*delay-now))
+
+    def isPendingPush(self, index):
+        return self._pendingPush.test(index)
+
+    def clearPush(self, index):
+        with self._lock:
+            self._pendingPush.clear(index)
 
     def signalPull(self, item, urgent=False):
-        if urgent:
-            self.memory._queuePendingPriorityPull.put(item)
+        return self.signalPullIndex(item.index, urgent)
+
+    def signalPullIndex(self, index, urgent=False):
+        with self._lock:
+            if self.joinInflightPull(index):
+                return False
+            if urgent:
+                # promote a pending background pull
+                self._pendingPull.clear(index)
+                if self._pendingPriorityPull.set(index):
+                    self._planPriorityPullDirty=True
+                    return True
+                return False
+            if not self._pendingPriorityPull.test(index):
+                return self._pendingPull.set(index)
+        return False
+
+    def snapshot(self, start=0, end=None):
+        """
+        Consistent read of the values of the declared indexes in [start, end), returned as a
+        list of (index, value, stamp), without lock : the published (value, stamp) pairs are copied
+        by a single C call (slice of the store, or map over the items), atomic with respect to the
+        frames publication (see publish), the list being built afterwards
+        """
+        start=max(0, start)
+        if end is None or end>self._maxsize:
+            end=self._maxsize
+        store=self._store
+        if store is not None:
+            (flags, snapshots)=store.snapshot(start, end)
+            declared=SAIAItemStore.FLAG_DECLARED
+            return [(start+n, snapshots[n][0], snapshots[n][1]) for n in range(len(flags)) if flags[n] & declared]
+
+        items=self._pages.items(start, end)
+        snapshots=list(map(attrgetter('_snapshot'), items))
+        return [(item._index, value, stamp) for (item, (value, stamp)) in zip(items, snapshots)]
+
+    def publish(self, items, snapshots):
+        """
+        Publish the (value, stamp) pairs of the items (of a collection without store) by a single
+        C call, atomic for the lock-free readers (see snapshot)
+        """
+        deque(map(setattr, items, itertools.repeat('_snapshot'), snapshots), 0)
+
+    def notifyWaiters(self):
+        """
+        Wake up the items blocking waits, the caller holding the collection lock
+        """
+        if self._waiters>0:
+            self._condition.notify_all()
+
+    def waitItemFlags(self, item, flags, timeout=None):
+        """
+        Wait until any of the given state flags of item is set (or timeout)
+        """
+        with self._condition:
+            if timeout is not None:
+                timeout=time.time()+timeout
+            self._waiters+=1
+            try:
+                while not item._flags & flags:
+                    delay=None
+                    if timeout is not None:
+                        delay=timeout-time.time()
+                        if delay<=0:
+                            return False
+                    self._condition.wait(delay)
+                return True
+            finally:
+                self._waiters-=1
+
+    def signalPulls(self, items, urgent=False):
+        """
+        Signal the pull of the given items of the collection at once, so that the read planner
+        sees all of them
+        """
+        with self._lock:
+            for item in items:
+                item.signalPull(urgent)
+
+    def registerGroupRead(self, read):
+        with self._lock:
+            if read not in self._groupReads:
+                self._groupReads.append(read)
+
+    def unregisterGroupRead(self, read):
+        with self._lock:
+            try:
+                self._groupReads.remove(read)
+            except:
+                pass
+
+    def nextSample(self):
+        return next(SAIAItems._sampleIds)
+
+    def ingestValues(self, index, values, count=None, stamp=None, sample=None):
+        """
+        Bulk update of the declared items [index, index+count) with the decoded values of a read
+        response, under a single lock acquisition. The pending pulls of the updated items are
+        cleared, and their events are notified in one batch afterwards. The values share the
+        frame receive time (stamp) and a new sample id (see SAIAItem.getSample)
+        """
+        if count is None:
+            count=len(values)
+        count=min(count, len(values))
+        updated=[]
+        if stamp is None:
+            stamp=time.time()
+        if sample is None:
+            sample=self.nextSample()
+        with self._lock:
+            changes=[]
+            self.ingest(index, values, count, stamp, sample, updated, changes)
+            if changes:
+                self.logChanges(changes)
+            self.notifyWaiters()
+
+        if self._groupReads:
+            items=[item for (item, raised, changed) in updated]
+            for read in list(self._groupReads):
+                read.onItemsUpdated(items)
+        return len(updated)
+
+    def ingest(self, index, values, count, stamp, sample, updated, changes):
+        """
+        Store the values of a read response (see ingestValues), the caller holding the lock.
+        The updated items and the changed indexes are appended to updated and changes. The
+        (value, stamp) pairs of the frame are published at once afterwards (see snapshot)
+        """
+        pages=self._pages
+        store=self._store
+        adaptive=self._adaptiveRefresh
+        items=[]
+        if store is not None:
+            snapshots=store.snapshot(index, index+count)[1]
         else:
-            self.memory._queuePendingPull.put(item)
+            snapshots=[]
+        for n in range(count):
+            item=pages.get(index+n)
+            if item is None and adaptive and store is not None and store.isDeclared(index+n):
+                # the adaptive refresh learns the change rate per item
+                item=self.materialize(index+n)
+            if item is not None:
+                # decoded values are already valid (no validateValue)
+                (raised, changed)=item.updateValue(values[n], True, stamp, sample, False)
+                updated.append((item, raised, changed))
+                if changed:
+                    changes.append(index+n)
+                snapshot=(values[n], stamp)
+            elif store is not None and store.isDeclared(index+n):
+                if store.update(index+n, values[n], stamp, sample, False):
+                    changes.append(index+n)
+                snapshot=(store.getValue(index+n), stamp)
+            else:
+                continue
+            if store is not None:
+                snapshots[n]=snapshot
+            else:
+                items.append(item)
+                snapshots.append(snapshot)
+            self._pendingPriorityPull.clear(index+n)
+            self._pendingPull.clear(index+n)
+
+        if store is not None:
+            store.publish(index, snapshots)
+        elif items:
+            self.publish(items, snapshots)
+
+    def logChanges(self, indexes):
+        """
+        Log the changed indexes in the collection (and memory) change log, the caller holding the lock
+        """
+        self._changes.extend(indexes)
+        self._memory.logChanges(self, indexes)
+
+    def generation(self):
+        """
+        Return the collection generation, incremented by each value change
+        """
+        return self._changes.generation()
+
+    def changesSince(self, generation=0):
+        """
+        Return (generation, indexes) : the current generation and the sorted indexes whose value
+        changed after the given generation. The change flags are not consumed, each consumer keeping
+        its own generation. indexes is None if the changes are not in the (bounded) log anymore,
+        the consumer having to resynchronize
+        """
+        with self._lock:
+            changes=self._changes.since(generation)
+            current=self._changes.generation()
+        if changes is None:
+            return (current, None)
+        return (current, sorted(set(changes)))
+
+    def setInflightPull(self, request):
+        with self._lock:
+            self._inflightPull=request
+
+    def clearInflightPull(self, request):
+        """
+        Clear the in-flight read request, returning the indexes that joined it
+        """
+        with self._lock:
+            if self._inflightPull is request:
+                self._inflightPull=None
+                return request.joined()
+        return []
+
+    def joinInflightPull(self, index):
+        """
+        Coalesce the pull of the index with the in-flight read request if it covers the index
+        """
+        with self._lock:
+            request=self._inflightPull
+            if request and request.covers(index):
+                request.join(index)
+                self._countCoalesced+=1
+                return True
+        return False
+
+    def isPendingPull(self, index):
+        if self._pendingPriorityPull.test(index) or self._pendingPull.test(index):
+            return True
+        return False
+
+    def clearPull(self, index):
+        with self._lock:
+            self._pendingPriorityPull.clear(index)
+            self._pendingPull.clear(index)
+
+    def countPendingPush(self):
+        return self._pendingPush.count()
+
+    def countPendingPriorityPull(self):
+        return self._pendingPriorityPull.count()
+
+    def countPendingPull(self):
+        return self._pendingPull.count()
+
+    def getPendingPushRun(self, index, maxcount):
+        """
+        Number of consecutive pending push from index (up to maxcount)
+        """
+        return self._pendingPush.run(index, maxcount)
+
+    def getPendingPullRun(self, index, maxcount):
+        """
+        Number of consecutive pending (urgent or background) pull from index (up to maxcount)
+        """
+        count=0
+        while count<maxcount:
+            n=max(self._pendingPriorityPull.run(index+count, maxcount-count),
+                self._pendingPull.run(index+count, maxcount-count))
+            if n==0:
+                break
+            count+=n
+        return count
+
+    def popPendingItem(self, bitmap, cursor):
+        """
+        Extract the next pending item (in index order, starting from cursor and wrapping around)
+        Return (item, cursor)
+        """
+        with self._lock:
+            index=bitmap.nextWrap(cursor)
+            while index is not None:
+                bitmap.clear(index)
+                item=self._pages.get(index)
+                if item:
+                    return (item, index+1)
+                index=bitmap.nextWrap(index+1)
+        return (None, 0)
+
+    def getNextPendingPush(self):
+        with self._lock:
+            # start from the beginning of the run of pending pushes, maximizing the write frame
+            index=self._pendingPush.nextWrap(self._cursorPush)
+            if index is not None:
+                count=self.PULL_MAXCOUNT-1
+                while count>0 and index>0 and self._pendingPush.test(index-1):
+                    index-=1
+                    count-=1
+                self._cursorPush=index
+            (item, self._cursorPush)=self.popPendingItem(self._pendingPush, self._cursorPush)
+            return item
+
+    def planPull(self, bitmap, plan):
+        """
+        (Re)compute the read frames covering the pending indexes of the bitmap
+        """
+        plan.clear()
+        plan.extend(self._planner.plan(bitmap, self._ranges))
+
+    def popPlannedFrame(self, bitmap, plan):
+        """
+        Extract the next planned read frame, returning the item at the frame start (or None).
+        The frame (index, count) is retained for the read request (see getPlannedPullCount).
+        Frames already (partially) served by another read since the plan was made are shrinked
+        to their remaining pending indexes, or skipped
+        """
+        with self._lock:
+            replanned=False
+            while True:
+                if not plan:
+                    if bitmap.isEmpty() or replanned:
+                        return None
+                    self.planPull(bitmap, plan)
+                    replanned=True
+                    continue
+
+                (index, count)=plan.popleft()
+                start=bitmap.next(index)
+                if start is None or start>=index+count:
+                    continue
+
+                end=start
+                while True:
+                    n=bitmap.next(end+1)
+                    if n is None or n>=index+count:
+                        break
+                    end=n
+
+                bitmap.clear(start)
+                item=self._pages.get(start)
+                if item is None and self._store is not None and self._store.isDeclared(start):
+                    item=self.frameItem(start)
+                if item:
+                    self._framePull=(start, end-start+1)
+                    return item
+
+                # not declared, shouldn't be pending
+                if end>start:
+                    plan.appendleft((start+1, end-start))
+
+    def pullRange(self, index, count):
+        """
+        Initiate the read of [index, index+count), index must be declared
+        """
+        with self._lock:
+            item=self.item(index)
+            if item:
+                self._framePull=(index, count)
+                return item.pull()
+        return False
+
+    def getPlannedPullCount(self, index):
+        """
+        Return the number of items to read for the planned frame starting at index (or None)
+        """
+        with self._lock:
+            frame=self._framePull
+            if frame and frame[0]==index:
+                self._framePull=None
+                return frame[1]
+
+    @property
+    def ranges(self):
+        return self._ranges
+
+    def markReadable(self, index, count=1):
+        with self._lock:
+            self._ranges.markReadable(index, count)
+            if self._suspects:
+                self.checkSuspects(index, count, False)
+
+    def checkSuspects(self, index, count, failing):
+        """
+        Update the rejected frames being searched with the result of the read of [index, index+count).
+        Once every declared index of a frame has been read alone, the failing index is known if one
+        of them failed : the holes of the frame are then not suspected anymore (unknown, bridged again).
+        Otherwise a hole is failing, and the holes stay marked as failing
+        """
+        for suspect in list(self._suspects):
+            (start, end, remaining, failed)=suspect
+            if index>=end or index+count<=start:
+                continue
+            for n in range(max(index, start), min(index+count, end)):
+                remaining.discard(n)
+                if failing:
+                    failed.add(n)
+            if not remaining:
+                self._suspects.remove(suspect)
+                if failed:
+                    for n in range(start, end):
+                        if n not in failed and self._ranges.state(n) is False:
+                            self._ranges.forget(n)
+
+    def onPullRejected(self, index, count=1):
+        """
+        A read of [index, index+count) was rejected (NAK) by the server. A single index is
+        known to fail. For a larger frame, the failing index is not known : the whole range
+        is marked as failing (holes not bridged), and the declared items are then read alone
+        in the background lane (and marked readable on success) to find the failing index
+        (see checkSuspects)
+        """
+        with self._lock:
+            if count==1 and self._ranges.state(index) is not False:
+                self.logger.warning('%s:%s index %d rejected by the server (not existing?)' % (self.server.host,
+                    self.__class__.__name__, index))
+            self._ranges.markFailing(index, count)
+            if count>1:
+                declared=set(self._declared.iterRange(index, index+count))
+                if declared:
+                    self._suspects.append((index, index+count, declared, set()))
+                for n in declared:
+                    item=self._pages.get(n)
+                    if item:
+                        item.signalPull()
+                    else:
+                        self.signalPullIndex(n)
+            elif self._suspects:
+                self.checkSuspects(index, 1, True)
+
+        if count==1 and self._groupReads:
+            item=self.item(index)
+            if item:
+                for read in list(self._groupReads):
+                    read.onItemFailed(item)
+
+    def clearIndexRanges(self):
+        with self._lock:
+            self._ranges.clear()
+            self._suspects.clear()
+
+    def getNextPendingPriorityPull(self):
+        with self._lock:
+            if self._planPriorityPullDirty:
+                # urgent pulls are few, replan to serve the new ones without waiting for the end of the plan
+                self._planPriorityPullDirty=False
+                self.planPull(self._pendingPriorityPull, self._planPriorityPull)
+            return self.popPlannedFrame(self._pendingPriorityPull, self._planPriorityPull)
+
+    def getNextPendingPull(self):
+        # background pulls signaled after the plan was made are served by the next plan
+        # (or by an earlier planned frame covering them)
+        return self.popPlannedFrame(self._pendingPull, self._planPull)
 
     def refresh(self):
         with self._lock:
-            for item in self._items:
+            for item in self._pages:
                 item.refresh()
+            if self._store is not None and not self._localNodeMode:
+                for index in self._store.indexes(False):
+                    self.signalPullIndex(index)
+
+    def getStoreRefreshDelay(self):
+        """
+        Refresh delay of the store indexes without item (collection delay, with load shedding)
+        """
+        delay=self.getRefreshDelay()
+        try:
+            delay*=self.memory.scheduler.getShedFactor(self.getPriority())
+        except:
+            pass
+        return delay
+
+    def scanStore(self, count=4096):
+        """
+        Refresh of the store indexes without item, scanning count indexes per call
+        """
+        delay=self.getStoreRefreshDelay()
+        with self._lock:
+            (indexes, self._cursorStore)=self._store.expired(time.time()-delay, self._cursorStore, count)
+            for index in indexes:
+                if not self._pendingPull.test(index):
+                    self.signalPullIndex(index)
 
     def manager(self):
-        count=min(64, len(self._items))
+        # group reads timeout
+        for read in list(self._groupReads):
+            read.checkDone()
+
+        if self._store is not None and not self._localNodeMode:
+            self.scanStore()
+
+        count=min(64, self._pages.count())
         while count>0:
             count-=1
-            try:
-                with self._lock:
-                    item=self._items[self._currentItem]
-                    self._currentItem+=1
+            with self._lock:
+                # round robin over the items, by index
+                item=self._pages.next(self._currentItem)
+                if item is None:
+                    self._currentItem=0
+                    break
+                self._currentItem=item.index+1
 
-                try:
-                    item.manager()
-                except:
-                    self.logger.exception('manager()')
+            try:
+                item.manager()
             except:
-                self._currentItem=0
-                if self._timeoutSort>0:
-                    with self._lock:
-                        if time.time()>self._timeoutSort:
-                            # sortimg indexes is useful for request index optimisers
-                            self.logger.info('%s re-sorting items indexes' % self)
-                            self._items.sort(key=lambda i: i.index)
-                            self._timeoutSort=0
-                break
+                self.logger.exception('manager()')
+
+    def matchIndex(self, index, key):
+        """
+        Match a store index without item with a key (see SAIAItem.match)
+        """
+        try:
+            if key in self.resolveTag(index):
+                return True
+        except:
+            pass
+
+        try:
+            if int(key)==index:
+                return True
+        except:
+            pass
+        return False
+
+    def strIndex(self, index, value, stamp):
+        """
+        Representation of a store index without item (see dump)
+        """
+        if isinstance(value, bool):
+            value='ON' if value else 'OFF'
+        delay=self.getStoreRefreshDelay()
+        alive=self.server.isAlive() and time.time()-stamp<=max(delay*1.5, 15.0)
+        return '<%s(index=%d, tag=%s, value=%s, age=%ds, refresh=%.01fs, alive=%d, store)>' % (self._itemType.__name__,
+            index, self.resolveTag(index), value, time.time()-stamp, delay, alive)
+
+    def iterSnapshot(self):
+        """
+        Iterate over the declared indexes, as (index, item, value, stamp), item being None for the
+        store indexes without item (not materialized)
+        """
+        if self._store is None:
+            for item in self.all():
+                yield (item.index, item, item.value, item._stamp)
+            return
+        pages=self._pages
+        for (index, value, stamp) in self.snapshot():
+            yield (index, pages.get(index), value, stamp)
 
     def dump(self):
-        with self._lock:
-            for item in self._items:
+        for (index, item, value, stamp) in self.iterSnapshot():
+            if item is not None:
                 print(item)
+            else:
+                print(self.strIndex(index, value, stamp))
 
     def table(self, key=None):
         with self._lock:
@@ -809,26 +2189,112 @@ class SAIAItems(object):
                 if not deviceName:
                     deviceName=self.server.host
 
-                for item in self._items:
-                    if key and not item.match(key):
-                        continue
-                    age='%.01fs' % item.age()
-                    t.add_row([deviceName, item.index, item.tag, item.formatedvalue, age])
+                now=time.time()
+                for (index, item, value, stamp) in self.iterSnapshot():
+                    if item is not None:
+                        if key and not item.match(key):
+                            continue
+                        t.add_row([deviceName, index, item.tag, item.formatedvalue, '%.01fs' % item.age()])
+                    else:
+                        if key and not self.matchIndex(index, key):
+                            continue
+                        t.add_row([deviceName, index, self.resolveTag(index), value, '%.01fs' % (now-stamp)])
 
                 print(t)
 
     def clear(self):
+        """
+        Write 0 to every declared index. The store indexes without item already at 0 are left
+        as is, the others being written through their item (the write requests are per item)
+        or set in the store in local node mode
+        """
         with self._lock:
-            for item in self._items:
+            for item in self.all():
+                item.clear()
+            if self._store is None or self.isReadOnly():
+                return
+            indexes=self._store.nonzero()
+            if self._localNodeMode:
+                zero=self._store.getZero()
+                stamp=time.time()
+                changes=[index for index in indexes if self._store.update(index, zero, stamp)]
+                if changes:
+                    self.logChanges(changes)
+                self.notifyWaiters()
+                return
+        for index in indexes:
+            item=self.item(index)
+            if item is not None:
                 item.clear()
 
+    def pollBudget(self):
+        """
+        Frames needed for a full refresh cycle of the declared items, using the same read
+        planner as the requests, and the resulting frames/s required to keep every item
+        at its nominal refresh delay (the load shedding and adaptive back-off are not the
+        demand, but the reaction to it)
+        """
+        budget={'items': 0, 'frames': 0, 'required': 0.0}
+        if self.isLocalNodeMode():
+            return budget
+
+        with self._lock:
+            items=[(item.index, item.getNominalRefreshDelay()) for item in self._pages]
+            if self._store is not None:
+                delay=self.getRefreshDelay()
+                items.extend([(index, delay) for index in self._store.indexes(False)])
+        items.sort()
+
+        budget['items']=len(items)
+        planner=SAIAPullPlanner(self.PULL_MAXCOUNT, self.PULL_ITEMCOST)
+        n=0
+        for (index, count) in planner.plan([i for (i, d) in items]):
+            delay=None
+            while n<len(items) and items[n][0]<index+count:
+                d=items[n][1]
+                if delay is None or d<delay:
+                    delay=d
+                n+=1
+            budget['frames']+=1
+            budget['required']+=1.0/max(delay, 0.001)
+        return budget
+
+    def stats(self):
+        with self._lock:
+            delays=[item.getRefreshDelay() for item in self._pages]
+            if self._store is not None:
+                # indexes without item, refreshed at the collection delay (see scanStore)
+                delays.extend([self.getStoreRefreshDelay()]*len(self._store.indexes(False)))
+            adaptive=[item for item in self._pages if item.isAdaptiveRefresh()]
+            stats={'items': self.count(),
+                'objects': self._pages.count(),
+                'pages': self._pages.countPages(),
+                'runs': self._declared.countRuns(),
+                'adaptive': len(adaptive),
+                'backedoff': len([item for item in adaptive if item.getRefreshDelay()>item.getNominalRefreshDelay()]),
+                'planner': self._planner.stats(),
+                'coalesced': self._countCoalesced,
+                'ranges': self._ranges.stats(),
+                'changes': self._changes.stats()}
+            if self._store is not None:
+                stats['store']=self._store.stats()
+            if delays:
+                stats['refreshMin']=min(delays)
+                stats['refreshMax']=max(delays)
+                stats['refreshMean']=sum(delays)/len(delays)
+            return stats
+
     def __repr__(self):
-        return '<%s(%d items, max=%d, readOnly=%d, current=%d, refresh=%.01fs)>' % (self.__class__.__name__,
+        return '<%s(%d items, max=%d, readOnly=%d, current=%d, refresh=%.01fs, adaptive=%d, queues %dR:%dR!:%dW)>' % (self.__class__.__name__,
                     self.count(),
                     self._maxsize,
                     bool(self._readOnly),
                     self._currentItem,
-                    self._delayRefresh)
+                    self._delayRefresh,
+                    self.isAdaptiveRefresh(),
+                    self.countPendingPull(),
+                    self.countPendingPriorityPull(),
+                    self.countPendingPush())
 
 
 if __name__ == "__main__":
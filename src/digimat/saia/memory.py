@@ -1,12 +1,14 @@
 from __future__ import print_function  # Python 2/3 compatibility
 
-# python2-3 compatibility require 'pip install future'
-from queue import Queue
 import time
+from threading import Lock
+from collections import deque
 
 from .items import SAIABooleanItem
 from .items import SAIAAnalogItem
 from .items import SAIAItems
+from .items import SAIAItemRange
+from .items import SAIAItem
 
 from .request import SAIARequestReadFlags
 from .request import SAIARequestWriteFlags
@@ -21,35 +23,23 @@ from .request import SAIARequestReadCounters
 from .request import SAIARequestWriteCounters
 
 from .symbol import SAIASymbol
-
-
-class SAIAItemQueue(Queue):
-    def _init(self, maxsize):
-        self._queue=[]
-
-    def _qsize(self):
-        return len(self._queue)
-
-    def _put(self, item):
-        if item not in self._queue:
-            self._queue.insert(0, item)
-
-    def _get(self):
-        item=self._queue.pop()
-        return item
+from .changelog import SAIAChangeLog
+from .scheduler import SAIAScheduler
 
 
 class SAIAItemFlag(SAIABooleanItem):
+    __slots__ = ()
+
     def onInit(self):
         super(SAIAItemFlag, self).onInit()
 
     def pull(self):
-        request=SAIARequestReadFlags(self.server.link)
+        request=self.server.link.acquire(SAIARequestReadFlags)
         request.setup(self, maxcount=96, holes=True)
         return request.initiate()
 
     def push(self):
-        request=SAIARequestWriteFlags(self.server.link)
+        request=self.server.link.acquire(SAIARequestWriteFlags)
         request.setup(self, maxcount=96)
         return request.initiate()
 
@@ -62,42 +52,48 @@ class SAIAItemFlag(SAIABooleanItem):
 
 
 class SAIAItemInput(SAIABooleanItem):
+    __slots__ = ()
+
     def onInit(self):
         super(SAIAItemInput, self).onInit()
         self.setReadOnly()
 
     def pull(self):
-        request=SAIARequestReadInputs(self.server.link)
+        request=self.server.link.acquire(SAIARequestReadInputs)
         request.setup(self, maxcount=96, holes=True)
         return request.initiate()
 
 
 class SAIAItemOutput(SAIABooleanItem):
+    __slots__ = ()
+
     def onInit(self):
         super(SAIAItemOutput, self).onInit()
 
     def pull(self):
-        request=SAIARequestReadOutputs(self.server.link)
+        request=self.server.link.acquire(SAIARequestReadOutputs)
         request.setup(self, maxcount=96, holes=True)
         return request.initiate()
 
     def push(self):
-        request=SAIARequestWriteOutputs(self.server.link)
+        request=self.server.link.acquire(SAIARequestWriteOutputs)
         request.setup(self, maxcount=96)
         return request.initiate()
 
 
 class SAIAItemRegister(SAIAAnalogItem):
+    __slots__ = ()
+
     def onInit(self):
         super(SAIAItemRegister, self).onInit()
 
     def pull(self):
-        request=SAIARequestReadRegisters(self.server.link)
+        request=self.server.link.acquire(SAIARequestReadRegisters)
         request.setup(self, maxcount=32, holes=True)
         return request.initiate()
 
     def push(self):
-        request=SAIARequestWriteRegisters(self.server.link)
+        request=self.server.link.acquire(SAIARequestWriteRegisters)
         request.setup(self, maxcount=32)
         return request.initiate()
 
@@ -110,18 +106,20 @@ class SAIAItemRegister(SAIAAnalogItem):
 
 
 class SAIAItemTimer(SAIAAnalogItem):
+    __slots__ = ('_stampTimer',)
+
     def onInit(self):
         super(SAIAItemTimer, self).onInit()
         if self.parent.isLocalNodeMode():
             self._stampTimer=0
 
     def pull(self):
-        request=SAIARequestReadTimers(self.server.link)
+        request=self.server.link.acquire(SAIARequestReadTimers)
         request.setup(self, maxcount=32, holes=True)
         return request.initiate()
 
     def push(self):
-        request=SAIARequestWriteTimers(self.server.link)
+        request=self.server.link.acquire(SAIARequestWriteTimers)
         request.setup(self, maxcount=32)
         return request.initiate()
 
@@ -158,16 +156,18 @@ class SAIAItemTimer(SAIAAnalogItem):
 
 
 class SAIAItemCounter(SAIAAnalogItem):
+    __slots__ = ()
+
     def onInit(self):
         super(SAIAItemCounter, self).onInit()
 
     def pull(self):
-        request=SAIARequestReadCounters(self.server.link)
+        request=self.server.link.acquire(SAIARequestReadCounters)
         request.setup(self, maxcount=32, holes=True)
         return request.initiate()
 
     def push(self):
-        request=SAIARequestWriteCounters(self.server.link)
+        request=self.server.link.acquire(SAIARequestWriteCounters)
         request.setup(self, maxcount=32)
         return request.initiate()
 
@@ -191,7 +191,9 @@ class SAIAItemCounter(SAIAAnalogItem):
 
 
 class SAIABooleanItems(SAIAItems):
-    pass
+    PULL_MAXCOUNT = 96
+    PULL_ITEMCOST = 0.125
+    STORE_TYPECODE = 'B'
 
 
 class SAIAFlags(SAIABooleanItems):
@@ -206,6 +208,12 @@ class SAIAFlags(SAIABooleanItems):
         except:
             pass
 
+    def resolveTag(self, index):
+        try:
+            return self.server.symbols.flag(index).tag
+        except:
+            return 'f%d' % index
+
     @property
     def symbols(self):
         return self.server.symbols.flags
@@ -233,7 +241,8 @@ class SAIAOutputs(SAIABooleanItems):
 
 
 class SAIAAnalogItems(SAIAItems):
-    pass
+    PULL_MAXCOUNT = 32
+    PULL_ITEMCOST = 4.0
 
 
 class SAIARegisters(SAIAAnalogItems):
@@ -248,6 +257,12 @@ class SAIARegisters(SAIAAnalogItems):
         except:
             pass
 
+    def resolveTag(self, index):
+        try:
+            return self.server.symbols.register(index).tag
+        except:
+            return 'r%d' % index
+
     @property
     def symbols(self):
         return self.server.symbols.registers
@@ -267,6 +282,9 @@ class SAIATimers(SAIAAnalogItems):
     def __init__(self, memory, maxsize=65535):
         super(SAIATimers, self).__init__(memory, SAIAItemTimer, maxsize)
         self._tickBaseTime=0.01
+        # local timers are decremented by their items manager
+        if self.isLocalNodeMode():
+            self._lazyRanges=False
 
     def setTickBaseTimeMs(self, basetime=100):
         self._tickBaseTimeMs=basetime/1000.0
@@ -279,6 +297,12 @@ class SAIATimers(SAIAAnalogItems):
         except:
             pass
 
+    def resolveTag(self, index):
+        try:
+            return self.server.symbols.timer(index).tag
+        except:
+            return 't%d' % index
+
     @property
     def symbols(self):
         return self.server.symbols.timer
@@ -306,6 +330,12 @@ class SAIACounters(SAIAAnalogItems):
         except:
             pass
 
+    def resolveTag(self, index):
+        try:
+            return self.server.symbols.counter(index).tag
+        except:
+            return 'c%d' % index
+
     @property
     def symbols(self):
         return self.server.symbols.counter
@@ -322,6 +352,15 @@ class SAIACounters(SAIAAnalogItems):
 
 
 class SAIAMemory(object):
+
+    # write verification policies
+    WRITE_VERIFY_TRUST = 0
+    WRITE_VERIFY_READBACK = 1
+    WRITE_VERIFY_DEFERRED = 2
+
+    # changes kept in the server change log (see changesSince)
+    CHANGELOG_SIZE = 16384
+
     def __init__(self, server, localNodeMode=False, enableOnTheFlyItemCreation=True):
         assert server.__class__.__name__=='SAIAServer'
         self._server=server
@@ -333,10 +372,18 @@ class SAIAMemory(object):
         self._registers=SAIARegisters(self)
         self._timers=SAIATimers(self)
         self._counters=SAIACounters(self)
-        self._queuePendingPull=SAIAItemQueue()
-        self._queuePendingPriorityPull=SAIAItemQueue()
-        self._queuePendingPush=SAIAItemQueue()
+        self._currentPush=0
+        self._delayWriteCombining=0.005
+        self._writeVerificationPolicy=self.WRITE_VERIFY_READBACK
+        self._readbacks=deque()
+        self._countReadback=0
+        self._currentPriorityPull=0
+        self._currentPull=0
+        self._scheduler=SAIAScheduler(self)
         self._readOnly=False
+        # values changes of every collection, numbered by the server generation
+        self._lockChanges=Lock()
+        self._changes=SAIAChangeLog(self.CHANGELOG_SIZE)
 
     @property
     def server(self):
@@ -346,6 +393,10 @@ class SAIAMemory(object):
     def logger(self):
         return self.server.logger
 
+    @property
+    def scheduler(self):
+        return self._scheduler
+
     @property
     def inputs(self):
         return self._inputs
@@ -414,39 +465,182 @@ class SAIAMemory(object):
             except:
                 pass
 
+    def setAdaptiveRefresh(self, state=True, delayMin=None, delayMax=None):
+        for items in self.items():
+            items.setAdaptiveRefresh(state, delayMin, delayMax)
+
+    def getNextPendingItem(self, current, getter):
+        """
+        Round robin over the item collections, returning (item, current)
+        """
+        collections=self.items()
+        count=len(collections)
+        while count>0:
+            count-=1
+            items=collections[current]
+            current=(current+1) % len(collections)
+            try:
+                item=getter(items)
+                if item:
+                    return (item, current)
+            except:
+                self.logger.exception('getNextPendingItem')
+        return (None, current)
+
+    def setWriteCombiningDelay(self, delay):
+        """
+        Delay (seconds) during which the pending pushes are held to be combined with the next
+        adjacent ones in the same write frame (0 to disable)
+        """
+        self._delayWriteCombining=max(0.0, float(delay))
+
+    def getWriteCombiningDelay(self):
+        return self._delayWriteCombining
+
     def getNextPendingPush(self):
+        delay=self._delayWriteCombining
+        (item, self._currentPush)=self.getNextPendingItem(self._currentPush,
+            lambda items: items.getNextPendingPush() if items.isPushReady(delay) else None)
+        return item
+
+    def setWriteVerificationPolicy(self, policy):
+        """
+        How the written values are verified after a successful write frame :
+        WRITE_VERIFY_TRUST (the ACK is trusted, values are set locally), WRITE_VERIFY_READBACK
+        (one read of the written range per write frame) or WRITE_VERIFY_DEFERRED (the written
+        items are refreshed by the background polling)
+        """
+        if policy in (self.WRITE_VERIFY_TRUST, self.WRITE_VERIFY_READBACK, self.WRITE_VERIFY_DEFERRED):
+            self._writeVerificationPolicy=policy
+
+    def getWriteVerificationPolicy(self):
+        return self._writeVerificationPolicy
+
+    def enableItemStore(self):
+        """
+        Use the columnar item store for every items collection (see SAIAItems.enableStore)
+        """
+        result=True
+        for items in self.items():
+            if not items.enableStore():
+                result=False
+        return result
+
+    def undeclare(self, items=None):
+        """
+        Undeclare the given item(s) of the memory (item, item range, group or list), or every
+        declared index if items is None. Return the number of undeclared indexes
+        """
+        if items is None:
+            return sum([collection.undeclareAll() for collection in self.items()])
+        if isinstance(items, (SAIAItem, SAIAItemRange)):
+            if items.parent.memory is self:
+                return items.parent.undeclare(items)
+            return 0
+        count=0
+        for item in list(items):
+            count+=self.undeclare(item)
+        return count
+
+    def logChanges(self, items, indexes):
+        # entries encoded as (collection number, index)
         try:
-            count=32
-            while count>0:
-                item=self._queuePendingPush.get(False)
-                if item.isPendingPushRequest():
-                    item.clearPush()
-                    return item
-                count-=1
+            key=self.all().index(items) << 20
+        except ValueError:
+            return
+        with self._lockChanges:
+            for index in indexes:
+                self._changes.append(key | index)
+
+    def generation(self):
+        """
+        Return the memory (server) generation, incremented by each value change of any collection
+        """
+        return self._changes.generation()
+
+    def changesSince(self, generation=0):
+        """
+        Return (generation, changes) : the current generation and the (collection, index) whose value
+        changed after the given generation, in the order of their first change. changes is None if
+        they are not in the (bounded) log anymore (see SAIAItems.changesSince)
+        """
+        with self._lockChanges:
+            entries=self._changes.since(generation)
+            current=self._changes.generation()
+        if entries is None:
+            return (current, None)
+        collections=self.all()
+        changes=[]
+        seen=set()
+        for key in entries:
+            if key not in seen:
+                seen.add(key)
+                changes.append((collections[key >> 20], key & 0xfffff))
+        return (current, changes)
+
+    def submitReadback(self, items, index, count):
+        self._readbacks.append((items, index, count, time.time()))
+
+    def countPendingReadback(self):
+        return len(self._readbacks)
+
+    def getNextReadback(self):
+        """
+        Return the next read back (items, index, count, stamp) of a written frame still declared,
+        or None. Read backs are served by the scheduler push class (see SAIATrafficClassPush)
+        """
+        while self._readbacks:
+            readback=self._readbacks.popleft()
+            if readback[0].isIndexDeclared(readback[1]):
+                return readback
+
+    def processReadback(self, readback):
+        (items, index, count, stamp)=readback
+        try:
+            if items.pullRange(index, count):
+                self._countReadback+=1
+                return True
         except:
-            pass
+            self.logger.exception('readback')
+        return False
+
+    def isPushReady(self):
+        for items in self.items():
+            if items.isPushReady(self._delayWriteCombining):
+                return True
+        return False
+
+    def getPushHoldDelay(self):
+        """
+        Time left (seconds) before the first held push is ready (write combining), or None
+        """
+        delays=[items.getPushHoldDelay(self._delayWriteCombining) for items in self.items()]
+        delays=[delay for delay in delays if delay is not None]
+        if delays:
+            return min(delays)
+
+    def getNextPendingPriorityPull(self):
+        (item, self._currentPriorityPull)=self.getNextPendingItem(self._currentPriorityPull, lambda items: items.getNextPendingPriorityPull())
+        return item
+
+    def getNextPendingBackgroundPull(self):
+        (item, self._currentPull)=self.getNextPendingItem(self._currentPull, lambda items: items.getNextPendingPull())
+        return item
 
     def getNextPendingPull(self):
-        count=64
-        try:
-            while count>0:
-                item=self._queuePendingPriorityPull.get(False)
-                if item.isPendingPullRequest():
-                    item.clearPull()
-                    return item
-                count-=1
-        except:
-            pass
+        item=self.getNextPendingPriorityPull()
+        if item:
+            return item
+        return self.getNextPendingBackgroundPull()
 
-        try:
-            while count>0:
-                item=self._queuePendingPull.get(False)
-                if item.isPendingPullRequest():
-                    item.clearPull()
-                    return item
-                count-=1
-        except:
-            pass
+    def countPendingPush(self):
+        return sum([items.countPendingPush() for items in self.items()])
+
+    def countPendingPriorityPull(self):
+        return sum([items.countPendingPriorityPull() for items in self.items()])
+
+    def countPendingPull(self):
+        return sum([items.countPendingPull() for items in self.items()])
 
     def manager(self):
         activity=False
@@ -456,22 +650,19 @@ class SAIAMemory(object):
         except:
             self.logger.exception('items:manager')
 
+        self._scheduler.manager()
+
         if self.server.isAlive() and self.server.link.isIdle():
-            item=self.getNextPendingPush()
-            if item:
-                if item.push():
+            # push (and read back verification of the written frames), urgent pull and
+            # background pull are served by the weighted fair queuing scheduler
+            selection=self._scheduler.next()
+            if selection:
+                (trafficClass, item)=selection
+                if trafficClass.process(item):
                     activity=True
                 else:
                     # TODO: requeue ?
-                    self.logger.error('push')
-            else:
-                item=self.getNextPendingPull()
-                if item:
-                    if item.pull():
-                        activity=True
-                    else:
-                        # TODO: requeue ?
-                        self.logger.error('pull')
+                    self.logger.error(trafficClass.name)
 
         if activity:
             return True
@@ -488,16 +679,71 @@ class SAIAMemory(object):
                 items.table(key)
 
     def isPendingPushRequest(self):
-        if not self._queuePendingPush.empty():
+        if self.countPendingPush()>0:
             return True
         return False
 
+    def named(self):
+        return (('inputs', self._inputs), ('outputs', self._outputs), ('flags', self._flags),
+                ('registers', self._registers), ('timers', self._timers), ('counters', self._counters))
+
+    def indexRangesToData(self):
+        data={}
+        for (name, items) in self.named():
+            data[name]=items.ranges.toData()
+        return data
+
+    def indexRangesFromData(self, data):
+        for (name, items) in self.named():
+            try:
+                if name in data:
+                    with items._lock:
+                        items.ranges.fromData(data[name])
+            except:
+                pass
+
+    def isIndexRangesDirty(self):
+        for items in self.items():
+            if items.ranges.isDirty():
+                return True
+        return False
+
+    def setIndexRangesDirty(self, state=True):
+        for items in self.items():
+            items.ranges.setDirty(state)
+
+    def clearIndexRanges(self):
+        for items in self.items():
+            items.clearIndexRanges()
+
+    def pollBudget(self):
+        budget={'items': 0, 'frames': 0, 'required': 0.0}
+        for (name, items) in self.named():
+            b=items.pollBudget()
+            budget[name]=b
+            budget['items']+=b['items']
+            budget['frames']+=b['frames']
+            budget['required']+=b['required']
+        return budget
+
+    def stats(self):
+        return {'items': self.count(),
+            'inputs': self._inputs.stats(),
+            'outputs': self._outputs.stats(),
+            'flags': self._flags.stats(),
+            'registers': self._registers.stats(),
+            'timers': self._timers.stats(),
+            'counters': self._counters.stats(),
+            'readback': self._countReadback,
+            'changes': self._changes.stats(),
+            'scheduler': self._scheduler.stats()}
+
     def __repr__(self):
         return '<%s(%d items, queues %dR:%dR!:%dW)>' % (self.__class__.__name__,
             self.count(),
-            self._queuePendingPull.qsize(),
-            self._queuePendingPriorityPull.qsize(),
-            self._queuePendingPush.qsize())
+            self.countPendingPull(),
+            self.countPendingPriorityPull(),
+            self.countPendingPush())
 
 
 if __name__ == "__main__":
@@ -683,6 +683,8 @@ class SAIANode(object):
         try:
             s=self.open()
             (data, address)=s.recvfrom(4096)
+            # receive time, shared by the values of the frame
+            stamp=time.time()
             if data:
                 host=address[0]
                 port=address[1]
@@ -704,10 +706,13 @@ class SAIANode(object):
                     except:
                         self.logger.exception('request')
                 else:
+                    if mtype==1 and self.servers.onFleetSweepReply(host, mseq, payload):
+                        return True
+
                     server=self.servers.getFromHost(address[0])
                     if server:
                         try:
-                            server.onMessage(mtype, mseq, payload)
+                            server.onMessage(mtype, mseq, payload, stamp)
                         except:
                             self.logger.exception('onMessage()')
                     else:
@@ -747,6 +752,13 @@ class SAIANode(object):
                 self.sleep(0.001)
                 self._activityCounter-=1
                 return True
+
+            # idle, but pushes held for write combining : sleep until the first one is ready
+            # instead of the default job manager sleep
+            delay=self.servers.getWakeupDelay()
+            if delay is not None and delay<0.1:
+                self.sleep(max(delay, 0.001))
+                return True
         except:
             pass
 
@@ -755,6 +767,12 @@ class SAIANode(object):
     def refresh(self):
         self.servers.refresh()
 
+    def pollBudget(self, rtt=None, margin=0.8):
+        return self.servers.pollBudget(rtt, margin)
+
+    def enableFleetSweep(self, state=True, interval=1.0):
+        self.servers.enableFleetSweep(state, interval)
+
     def start(self):
         try:
             if self._jobs:
@@ -774,6 +792,11 @@ class SAIANode(object):
             pass
         self._jobSAIA=None
         self._jobs=None
+        try:
+            # keep the learned index ranges for the next start
+            self.servers.saveIndexRanges()
+        except:
+            pass
 
     def isRunning(self):
         try:
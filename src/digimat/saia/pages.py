@@ -0,0 +1,119 @@
+from __future__ import division
+
+
+class SAIAItemPages(object):
+    """
+    Sparse paged map of the items of a collection by index. The index space is divided into
+    pages of PAGESIZE indexes, allocated on demand, each page being a dense list of items.
+    Lookups and neighbours are O(1) per index, and the iteration is always ordered by index
+    (no re-sort needed)
+    """
+
+    PAGESHIFT = 8
+    PAGESIZE = 1 << PAGESHIFT
+    PAGEMASK = PAGESIZE-1
+
+    def __init__(self, maxsize):
+        self._maxsize=maxsize
+        self._pages=[None]*((maxsize >> self.PAGESHIFT)+1)
+        self._counts=[0]*len(self._pages)
+        self._count=0
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def countPages(self):
+        return len([page for page in self._pages if page is not None])
+
+    def get(self, index, default=None):
+        if index>=0:
+            try:
+                page=self._pages[index >> self.PAGESHIFT]
+                if page is not None:
+                    item=page[index & self.PAGEMASK]
+                    if item is not None:
+                        return item
+            except IndexError:
+                pass
+        return default
+
+    def __contains__(self, index):
+        if self.get(index) is not None:
+            return True
+        return False
+
+    def set(self, index, item):
+        n=index >> self.PAGESHIFT
+        page=self._pages[n]
+        if page is None:
+            page=[None]*self.PAGESIZE
+            self._pages[n]=page
+        if page[index & self.PAGEMASK] is None:
+            self._counts[n]+=1
+            self._count+=1
+        page[index & self.PAGEMASK]=item
+
+    def remove(self, index):
+        """
+        Remove and return the item at index (or None), freeing its page when empty
+        """
+        item=self.get(index)
+        if item is not None:
+            n=index >> self.PAGESHIFT
+            self._pages[n][index & self.PAGEMASK]=None
+            self._counts[n]-=1
+            self._count-=1
+            if self._counts[n]==0:
+                self._pages[n]=None
+        return item
+
+    def clear(self):
+        self._pages=[None]*len(self._pages)
+        self._counts=[0]*len(self._pages)
+        self._count=0
+
+    def iterRange(self, start=0, end=None):
+        """
+        Iterate over the items with start <= index < end, by index
+        """
+        start=max(0, start)
+        if end is None or end>self._maxsize:
+            end=self._maxsize
+        n=start >> self.PAGESHIFT
+        while n<len(self._pages):
+            base=n << self.PAGESHIFT
+            if base>=end:
+                break
+            page=self._pages[n]
+            if page is not None:
+                for offset in range(max(start-base, 0), min(end-base, self.PAGESIZE)):
+                    item=page[offset]
+                    if item is not None:
+                        yield item
+            n+=1
+
+    def __iter__(self):
+        return self.iterRange()
+
+    def items(self, start=0, end=None):
+        return list(self.iterRange(start, end))
+
+    def next(self, index):
+        """
+        Return the first item at or after index (or None)
+        """
+        for item in self.iterRange(index):
+            return item
+
+    def stats(self):
+        return {'items': self._count, 'pages': self.countPages(), 'pagesize': self.PAGESIZE}
+
+    def __repr__(self):
+        return '<%s(items=%d, pages=%d)>' % (self.__class__.__name__, self._count, self.countPages())
+
+
+if __name__ == "__main__":
+    pass
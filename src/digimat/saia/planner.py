@@ -0,0 +1,118 @@
+from __future__ import division
+
+from collections import deque
+
+
+class SAIAPullPlanner(object):
+    """
+    Compute the read frames covering a set of pending indexes of an items collection.
+
+    Each frame reads a window of at most maxcount consecutive indexes, starting and ending
+    on a pending index. A frame costs frameCost plus itemCost for each index it reads, holes
+    (indexes that are not pending) included. The plan minimizing the total cost is found
+    by dynamic programming in O(n) (sliding window minimum), so two groups of pending indexes
+    are read in the same frame only if the hole between them is cheaper than another frame.
+
+    Costs are expressed in bytes : itemCost is the size of an item in the response, and
+    frameCost the per frame overhead (headers, ack, round trip)
+
+    When the learned index ranges of the collection are given (SAIAIndexRanges), holes known
+    to be readable are bridged at their normal cost, unknown holes are riskier (riskFactor)
+    and frames are never spanning an index known to fail
+    """
+
+    def __init__(self, maxcount, itemCost=4.0, frameCost=96.0, riskFactor=2.0):
+        self._maxcount=max(1, int(maxcount))
+        self._itemCost=float(itemCost)
+        self._frameCost=float(frameCost)
+        self._riskFactor=float(riskFactor)
+        self._countPlans=0
+        self._countFrames=0
+        self._countIndexes=0
+        self._countHoles=0
+
+    @property
+    def maxcount(self):
+        return self._maxcount
+
+    def cost(self, count):
+        """
+        Cost of a frame reading count indexes
+        """
+        return self._frameCost+count*self._itemCost
+
+    def plan(self, indexes, ranges=None):
+        """
+        Return the list of (index, count) frames covering the given (sorted) indexes
+        """
+        points=list(indexes)
+        n=len(points)
+        if n==0:
+            return []
+
+        c=self._itemCost
+
+        # cumulated cost of the indexes (points and holes) up to each point, and
+        # barriers (frames can't start before barrier[j] when ending at point j)
+        acc=[0.0]*n
+        barrier=[0]*n
+        for j in range(1, n):
+            holes=points[j]-points[j-1]-1
+            step=c
+            b=barrier[j-1]
+            if ranges is not None:
+                if ranges.isFailing(points[j-1], points[j]+1):
+                    b=j
+                if holes>0:
+                    readable=ranges.countReadable(points[j-1]+1, points[j])
+                    step+=readable*c+(holes-readable)*c*self._riskFactor
+            else:
+                step+=holes*c
+            acc[j]=acc[j-1]+step
+            barrier[j]=b
+
+        cost=[0.0]*(n+1)
+        choice=[0]*(n+1)
+
+        # candidate frame starts i (within reach of the current point), by increasing cost[i]-acc[i]
+        candidates=deque()
+        for j in range(n):
+            key=cost[j]-acc[j]
+            # strictly greater only, keeping the oldest (largest frame) on equal cost
+            while candidates and cost[candidates[-1]]-acc[candidates[-1]]>key:
+                candidates.pop()
+            candidates.append(j)
+            while points[j]-points[candidates[0]]>=self._maxcount or candidates[0]<barrier[j]:
+                candidates.popleft()
+            i=candidates[0]
+            cost[j+1]=cost[i]+self._frameCost+acc[j]-acc[i]+c
+            choice[j+1]=i
+
+        frames=[]
+        j=n
+        while j>0:
+            i=choice[j]
+            frames.append((points[i], points[j-1]-points[i]+1))
+            j=i
+        frames.reverse()
+
+        self._countPlans+=1
+        self._countFrames+=len(frames)
+        self._countIndexes+=n
+        self._countHoles+=sum([count for (index, count) in frames])-n
+        return frames
+
+    def stats(self):
+        return {'maxcount': self._maxcount,
+            'plans': self._countPlans,
+            'frames': self._countFrames,
+            'indexes': self._countIndexes,
+            'holes': self._countHoles}
+
+    def __repr__(self):
+        return '<%s(maxcount=%d, plans=%d, frames=%d, indexes=%d, holes=%d)>' % (self.__class__.__name__,
+            self._maxcount, self._countPlans, self._countFrames, self._countIndexes, self._countHoles)
+
+
+if __name__ == "__main__":
+    pass
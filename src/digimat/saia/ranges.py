@@ -0,0 +1,335 @@
+from __future__ import division
+
+from bisect import bisect_left
+from bisect import bisect_right
+
+
+class SAIAIndexRanges(object):
+    """
+    Learned state of an items index space, as a sorted list of disjoint [start, end) ranges
+    known to be readable (True) or known to fail (False). Indexes not covered by
+    any range are unknown (None)
+    """
+
+    def __init__(self):
+        self._starts=[]
+        self._ends=[]
+        self._states=[]
+        self._dirty=False
+
+    def isDirty(self):
+        if self._dirty:
+            return True
+        return False
+
+    def setDirty(self, state=True):
+        self._dirty=bool(state)
+
+    def count(self):
+        return len(self._starts)
+
+    def __len__(self):
+        return self.count()
+
+    def clear(self):
+        if self._starts:
+            self._dirty=True
+        self._starts=[]
+        self._ends=[]
+        self._states=[]
+
+    def mark(self, start, count, state):
+        """
+        Set the state of the indexes [start, start+count), overwriting the previous knowledge
+        (state None forgets it)
+        """
+        end=start+count
+        if count<=0:
+            return
+        if state is None:
+            if self.countState(start, end, True)+self.countState(start, end, False)==0:
+                return
+        else:
+            state=bool(state)
+            if self.countState(start, end, state)==count:
+                return
+
+        starts=[]
+        ends=[]
+        states=[]
+        inserted=False
+        for n in range(len(self._starts)):
+            s=self._starts[n]
+            e=self._ends[n]
+            v=self._states[n]
+            if e<=start or s>=end:
+                if s>=end and not inserted:
+                    if state is not None:
+                        starts.append(start)
+                        ends.append(end)
+                        states.append(state)
+                    inserted=True
+                starts.append(s)
+                ends.append(e)
+                states.append(v)
+            else:
+                # overlapping range, keep the parts outside [start, end)
+                if s<start:
+                    starts.append(s)
+                    ends.append(start)
+                    states.append(v)
+                if not inserted:
+                    if state is not None:
+                        starts.append(start)
+                        ends.append(end)
+                        states.append(state)
+                    inserted=True
+                if e>end:
+                    starts.append(end)
+                    ends.append(e)
+                    states.append(v)
+        if not inserted and state is not None:
+            starts.append(start)
+            ends.append(end)
+            states.append(state)
+
+        # merge adjacent ranges with the same state
+        self._starts=[]
+        self._ends=[]
+        self._states=[]
+        for n in range(len(starts)):
+            if self._starts and self._ends[-1]==starts[n] and self._states[-1]==states[n]:
+                self._ends[-1]=ends[n]
+            else:
+                self._starts.append(starts[n])
+                self._ends.append(ends[n])
+                self._states.append(states[n])
+        self._dirty=True
+
+    def markReadable(self, start, count=1):
+        self.mark(start, count, True)
+
+    def markFailing(self, start, count=1):
+        self.mark(start, count, False)
+
+    def forget(self, start, count=1):
+        self.mark(start, count, None)
+
+    def state(self, index):
+        """
+        Return True (readable), False (failing) or None (unknown)
+        """
+        n=bisect_right(self._starts, index)-1
+        if n>=0 and index<self._ends[n]:
+            return self._states[n]
+        return None
+
+    def countState(self, start, end, state):
+        """
+        Number of indexes in [start, end) having the given (known) state
+        """
+        count=0
+        n=max(0, bisect_right(self._starts, start)-1)
+        while n<len(self._starts) and self._starts[n]<end:
+            if self._states[n]==state:
+                count+=max(0, min(end, self._ends[n])-max(start, self._starts[n]))
+            n+=1
+        return count
+
+    def countReadable(self, start, end):
+        return self.countState(start, end, True)
+
+    def isFailing(self, start, end=None):
+        """
+        True if any index in [start, end) is known to fail
+        """
+        if end is None:
+            end=start+1
+        if self.countState(start, end, False)>0:
+            return True
+        return False
+
+    def ranges(self, state):
+        return [[self._starts[n], self._ends[n]] for n in range(len(self._starts)) if self._states[n]==state]
+
+    def toData(self):
+        return {'readable': self.ranges(True), 'failing': self.ranges(False)}
+
+    def fromData(self, data):
+        self.clear()
+        try:
+            for (start, end) in data.get('readable', []):
+                self.markReadable(int(start), int(end)-int(start))
+            for (start, end) in data.get('failing', []):
+                self.markFailing(int(start), int(end)-int(start))
+        except:
+            pass
+        self._dirty=False
+
+    def stats(self):
+        return {'ranges': len(self._starts),
+            'readable': sum([self._ends[n]-self._starts[n] for n in range(len(self._starts)) if self._states[n]]),
+            'failing': sum([self._ends[n]-self._starts[n] for n in range(len(self._starts)) if not self._states[n]])}
+
+    def __repr__(self):
+        stats=self.stats()
+        return '<%s(ranges=%d, readable=%d, failing=%d)>' % (self.__class__.__name__,
+            stats['ranges'], stats['readable'], stats['failing'])
+
+
+class SAIAIndexRuns(object):
+    """
+    Set of indexes kept as sorted disjoint runs [start, end). Lookups, neighbours and range
+    queries are O(log n) (n being the number of runs), insertion and removal are done in place
+    """
+
+    def __init__(self):
+        self._starts=[]
+        self._ends=[]
+        self._count=0
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def countRuns(self):
+        return len(self._starts)
+
+    def find(self, index):
+        """
+        Return the position of the run containing index, or -1
+        """
+        n=bisect_right(self._starts, index)-1
+        if n>=0 and index<self._ends[n]:
+            return n
+        return -1
+
+    def __contains__(self, index):
+        if self.find(index)>=0:
+            return True
+        return False
+
+    def add(self, index, count=1):
+        """
+        Add the indexes [index, index+count), returning the number of new ones
+        """
+        if count<=0:
+            return 0
+        start=index
+        end=index+count
+        # runs overlapping or adjacent to [start, end)
+        lo=bisect_left(self._ends, start)
+        hi=bisect_right(self._starts, end)
+        merged=0
+        if lo<hi:
+            merged=sum([self._ends[n]-self._starts[n] for n in range(lo, hi)])
+            start=min(start, self._starts[lo])
+            end=max(end, self._ends[hi-1])
+        self._starts[lo:hi]=[start]
+        self._ends[lo:hi]=[end]
+        added=(end-start)-merged
+        self._count+=added
+        return added
+
+    def remove(self, index, count=1):
+        """
+        Remove the indexes [index, index+count), returning the number of removed ones
+        """
+        if count<=0:
+            return 0
+        start=index
+        end=index+count
+        # runs overlapping [start, end)
+        lo=bisect_right(self._ends, start)
+        hi=bisect_left(self._starts, end)
+        if lo>=hi:
+            return 0
+        removed=0
+        starts=[]
+        ends=[]
+        for n in range(lo, hi):
+            s=self._starts[n]
+            e=self._ends[n]
+            removed+=min(e, end)-max(s, start)
+            if s<start:
+                starts.append(s)
+                ends.append(start)
+            if e>end:
+                starts.append(end)
+                ends.append(e)
+        self._starts[lo:hi]=starts
+        self._ends[lo:hi]=ends
+        self._count-=removed
+        return removed
+
+    def clear(self):
+        self._starts=[]
+        self._ends=[]
+        self._count=0
+
+    def next(self, index):
+        """
+        Return the first index >= index (or None)
+        """
+        n=bisect_right(self._starts, index)-1
+        if n>=0 and index<self._ends[n]:
+            return index
+        if n+1<len(self._starts):
+            return self._starts[n+1]
+        return None
+
+    def last(self, start, end):
+        """
+        Return the last index in [start, end) (or None)
+        """
+        n=bisect_left(self._starts, end)-1
+        if n>=0 and self._ends[n]>start and end>start:
+            return min(self._ends[n], end)-1
+        return None
+
+    def run(self, index, maxcount):
+        """
+        Number of consecutive indexes from index (at most maxcount)
+        """
+        n=self.find(index)
+        if n<0:
+            return 0
+        return min(self._ends[n]-index, maxcount)
+
+    def runs(self, start=0, end=None):
+        """
+        Return the runs (index, count) within [start, end)
+        """
+        runs=[]
+        n=max(0, bisect_right(self._starts, start)-1)
+        while n<len(self._starts):
+            s=max(self._starts[n], start)
+            e=self._ends[n]
+            if end is not None:
+                if s>=end:
+                    break
+                e=min(e, end)
+            if e>s:
+                runs.append((s, e-s))
+            n+=1
+        return runs
+
+    def iterRange(self, start=0, end=None):
+        """
+        Iterate over the indexes in [start, end)
+        """
+        for (index, count) in self.runs(start, end):
+            for n in range(index, index+count):
+                yield n
+
+    def __iter__(self):
+        return self.iterRange()
+
+    def __repr__(self):
+        return '<%s(count=%d, runs=%d)>' % (self.__class__.__name__, self._count, len(self._starts))
+
+
+if __name__ == "__main__":
+    pass
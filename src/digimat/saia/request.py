@@ -3,10 +3,11 @@ from __future__ import division
 
 import struct
 import time
+import sys
+from array import array
 from functools import reduce
 from builtins import bytes
 
-from .utils import unpack_bin
 from .ModbusDataLib import boollist2bin
 
 # This is the precalculated hash table for CCITT V.41.
@@ -77,8 +78,93 @@ def SAIASBusCRCTableCheck():
         return True
 
 
+class SAIAFrameTemplateCache(object):
+    """
+    Cache of the encoded request frames (command, lid, payload) of a link. When a cached frame
+    is sent again, only the sequence field and the CRC are patched.
+
+    The CRC (initial value 0, no final xor) is linear : the CRC of the frame with a given sequence
+    is the CRC of the template (sequence 0) xored with the CRC of the sequence bytes followed by
+    as many zero bytes as the remaining frame bytes, taken from 2 lookup tables per frame size
+    """
+
+    # sequence field offset in the frame (after the frame length, protocol number and type)
+    OFFSET_SEQUENCE = 6
+    ENCODER_UINT16 = struct.Struct('>H')
+
+    def __init__(self, maxsize=1024):
+        self._maxsize=maxsize
+        self._frames={}
+        self._tables={}
+        self._hits=0
+        self._misses=0
+
+    def table(self, trailing):
+        """
+        CRC of each byte value followed by trailing zero bytes
+        """
+        table=self._tables.get(trailing)
+        if table is None:
+            table=[0]*256
+            for b in range(256):
+                crc=SAIASBusCRCTable[b]
+                for n in range(trailing):
+                    crc=SAIASBusCRCTable[(crc >> 8) & 0xFF] ^ ((crc << 8) & 0xFFFF)
+                table[b]=crc
+            self._tables[trailing]=table
+        return table
+
+    def frame(self, request, payload):
+        """
+        Return the frame of the request (with its current sequence) for the given payload. The
+        frame is a buffer shared by the frames of the same template, valid until the next one
+        """
+        key=(request._command, request.frameLid(), payload)
+        entry=self._frames.get(key)
+        if entry is None:
+            self._misses+=1
+            sequence=request._sequence
+            try:
+                request._sequence=0
+                frame=request.createFrameWithPayload(payload)
+            finally:
+                request._sequence=sequence
+            size=len(frame)-2
+            offset=self.OFFSET_SEQUENCE
+            # the frame buffer is reused, only its sequence and crc fields being patched
+            entry=(bytearray(frame), size,
+                struct.unpack('>H', frame[-2:])[0],
+                self.table(size-offset-1), self.table(size-offset-2))
+            if len(self._frames)>=self._maxsize:
+                self._frames.clear()
+            self._frames[key]=entry
+        else:
+            self._hits+=1
+
+        (frame, size, crc, tableHigh, tableLow)=entry
+        sequence=request._sequence
+        crc ^= tableHigh[(sequence >> 8) & 0xFF] ^ tableLow[sequence & 0xFF]
+        encoder=self.ENCODER_UINT16
+        encoder.pack_into(frame, self.OFFSET_SEQUENCE, sequence)
+        encoder.pack_into(frame, size, crc)
+        return frame
+
+    def clear(self):
+        self._frames.clear()
+
+    def stats(self):
+        return {'frames': len(self._frames), 'hits': self._hits, 'misses': self._misses}
+
+    def __repr__(self):
+        return '<%s(frames=%d, hits=%d, misses=%d)>' % (self.__class__.__name__,
+            len(self._frames), self._hits, self._misses)
+
+
 class SAIARequest(object):
 
+    # stable frames (same command, lid and payload when repeated) are built from the link frame cache
+    CACHEABLE = False
+
     COMMAND_READ_FLAGS = 0x02
     COMMAND_READ_INPUTS = 0x03
     COMMAND_READ_OUTPUTS = 0x05
@@ -114,26 +200,46 @@ class SAIARequest(object):
 
     COMMAND_READ_PCD_STATUS_OWN = 0x1b
 
+    # precompiled big endian uint32 decoders, by count
+    DECODERS_UINT32 = {}
+
     def __init__(self, link, retry=3, broadcast=False):
         assert link.__class__.__name__=='SAIALink'
         self._link=link
         self._broadcast=broadcast
+        self._retryMax=retry
         self._retry=retry
+        self._pooled=False
         self._data=None
         self._dataReply=None
         self._command=0
         self._stamp=0
+        self._stampReceive=None
         self._ready=False
         self._start=False
         self._done=False
         self._result=False
         self._sequence=0
         self.onInit()
-        SAIASBusCRCTableCheck()
 
     def onInit(self):
         pass
 
+    def recycle(self):
+        """
+        Reset the request state, allowing the (pooled) request object to be reused
+        """
+        self._retry=self._retryMax
+        self._data=None
+        self._dataReply=None
+        self._stamp=0
+        self._stampReceive=None
+        self._ready=False
+        self._start=False
+        self._done=False
+        self._result=False
+        self._sequence=0
+
     def setup(self):
         pass
 
@@ -187,23 +293,31 @@ class SAIARequest(object):
         # [data]
         # crc
 
+        lid=self.frameLid()
+
         if payload:
             sizePayload=len(payload)
             fsize=13+sizePayload
             frame=struct.pack('>L BBHB BB %ds' % sizePayload,
                 fsize,
                 0, 0, self._sequence, 0,
-                self.server.lid, self._command,
+                lid, self._command,
                 payload)
         else:
             fsize=13
             frame=struct.pack('>L BBHB BB',
                 fsize,
                 0, 0, self._sequence, 0,
-                self.server.lid, self._command)
+                lid, self._command)
 
         return struct.pack('>%ds H' % len(frame), frame, SAIASBusCRC(frame))
 
+    def frameLid(self):
+        if self._broadcast:
+            # broadcast (don't care) address
+            return 255
+        return self.server.lid
+
     def encode(self):
         """
         create binary data frame from request data
@@ -238,7 +352,10 @@ class SAIARequest(object):
         try:
             if self.isReady():
                 self._sequence=self.link.generateMsgSeq()
-                self._data=self.createFrameWithPayload(self.encode())
+                if self.CACHEABLE:
+                    self._data=self.link.frameCache.frame(self, self.encode())
+                else:
+                    self._data=self.createFrameWithPayload(self.encode())
                 self._stamp=time.time()
             else:
                 self.logger.error('%s:unable to encode (not ready)' % self.__class__)
@@ -271,6 +388,17 @@ class SAIARequest(object):
             if sequence==self._sequence:
                 return True
 
+    def setReceiveStamp(self, stamp):
+        """
+        Time of the reception of the response (socket read), shared by all the values of the frame
+        """
+        self._stampReceive=stamp
+
+    def receiveStamp(self):
+        if self._stampReceive is None:
+            return time.time()
+        return self._stampReceive
+
     def processResponse(self, payload):
         self._dataReply=payload
         return True
@@ -281,6 +409,12 @@ class SAIARequest(object):
     def onFailure(self):
         self.logger.error('%s<--%s:ERROR' % (self.server.host, self.__class__.__name__))
 
+    def onReject(self, code):
+        """
+        Called when the request was rejected by the server (NAK), before its failure
+        """
+        pass
+
     def start(self):
         self._start=True
         self._done=False
@@ -298,7 +432,13 @@ class SAIARequest(object):
             pass
 
     def data2uint32list(self, data):
-        return list(struct.unpack('>%dI' % (len(data) // 4), data))
+        count=len(data) // 4
+        try:
+            decoder=SAIARequest.DECODERS_UINT32[count]
+        except KeyError:
+            decoder=struct.Struct('>%dI' % count)
+            SAIARequest.DECODERS_UINT32[count]=decoder
+        return decoder.unpack(data)
 
     def __repr__(self):
         return '%s(mseq=%d)' % (self.__class__.__name__, self.sequence)
@@ -311,6 +451,9 @@ class SAIARequest(object):
 
 
 class SAIARequestReadStationNumber(SAIARequest):
+
+    CACHEABLE = True
+
     def onInit(self):
         self._command=SAIARequest.COMMAND_READ_STATIONNUMBER
         self.ready()
@@ -325,6 +468,9 @@ class SAIARequestReadStationNumber(SAIARequest):
 
 
 class SAIARequestReadPcdStatusOwn(SAIARequest):
+
+    CACHEABLE = True
+
     def onInit(self):
         self._command=SAIARequest.COMMAND_READ_PCD_STATUS_OWN
         self.ready()
@@ -407,9 +553,21 @@ class SAIARequestReadDBX(SAIARequest):
 
 
 class SAIARequestReadItems(SAIARequest):
+
+    CACHEABLE = True
+
     def setup(self, item, maxcount=1, holes=False):
         self._item=item
-        self._count=self.optimizePullCount(maxcount, holes)
+        try:
+            del self._joined[:]
+        except AttributeError:
+            self._joined=[]
+        # frame computed by the collection read planner (see SAIAPullPlanner)
+        count=self.items().getPlannedPullCount(item.index)
+        if count:
+            self._count=min(count, maxcount)
+        else:
+            self._count=self.optimizePullCount(maxcount, holes)
         self.ready()
 
     @property
@@ -428,28 +586,45 @@ class SAIARequestReadItems(SAIARequest):
         """
 
         try:
-            item=self.item
-
+            index=self.item.index
             if holes:
-                while maxcount>0:
-                    if item.next(maxcount-1):
-                        count=maxcount
-                        break
-                    maxcount-=1
-            else:
-                count=1
-                while count<maxcount:
-                    item=item.next()
-                    if item is None:
-                        break
-                    count+=1
-
-            return count
+                return self.items().lastDeclaredIndex(index, maxcount)-index+1
+            return max(1, self.items().countDeclaredRun(index, maxcount))
         except:
             pass
 
         return 1
 
+    def covers(self, index):
+        index0=self.item.index
+        if index>=index0 and index<index0+self._count:
+            return True
+        return False
+
+    def join(self, index):
+        """
+        A pull of the (covered) index is coalesced with this request
+        """
+        self._joined.append(index)
+
+    def joined(self):
+        return self._joined
+
+    def start(self):
+        super(SAIARequestReadItems, self).start()
+        self.items().setInflightPull(self)
+
+    def stop(self, success):
+        joined=self.items().clearInflightPull(self)
+        super(SAIARequestReadItems, self).stop(success)
+        if not success:
+            # the coalesced pulls are queued again
+            items=self.items()
+            for index in joined:
+                item=items.item(index)
+                if item:
+                    item.signalPull(urgent=True)
+
     def encode(self):
         # count = number of item to read - 1
         return struct.pack('>BH',
@@ -464,25 +639,54 @@ class SAIARequestReadItems(SAIARequest):
         values=self.extractValuesFromPayload(payload)
 
         items=self.items()
+        # the new pulls from now won't be satisfied by this response
+        items.clearInflightPull(self)
 
-        for n in range(count):
-            # decode only pre-declared (existing) items
-            # this allows sending grouped read requests
-            item=items.item(index0+n)
-            if item:
-                item.setValue(values[n], force=True)
-                item.clearPull()
+        # decode only pre-declared (existing) items
+        # this allows sending grouped read requests
+        items.ingestValues(index0, values, count, self.receiveStamp())
 
+        items.markReadable(index0, count)
         return True
 
+    def onReject(self, code):
+        if code==1:
+            self.items().onPullRejected(self.item.index, self._count)
+
     def __repr__(self):
         return '%s(mseq=%d, index=%d, count=%d)' % (self.__class__.__name__,
             self.sequence, self.item.index, self._count)
 
 
 class SAIARequestReadAnalogItems(SAIARequestReadItems):
+
+    # native uint32 array type, and byte order swap needed to decode big endian values
+    TYPECODE_UINT32 = 'I' if array('I').itemsize==4 else 'L'
+    SWAP_UINT32 = (sys.byteorder=='little')
+
     def extractValuesFromPayload(self, payload):
-        return self.data2uint32list(payload)
+        # values decoded into a buffer of the request reused by the next frames of the same size
+        # (the request being recycled), instead of a new tuple per frame
+        count=len(payload) // 4
+        try:
+            buffers=self._buffers
+        except AttributeError:
+            buffers={}
+            self._buffers=buffers
+        try:
+            (values, view)=buffers[count]
+        except KeyError:
+            try:
+                values=array(self.TYPECODE_UINT32, [0])*count
+                view=memoryview(values).cast('B')
+            except:
+                # python2 (no memoryview.cast)
+                return self.data2uint32list(payload)
+            buffers[count]=(values, view)
+        view[:]=payload[:count*4]
+        if self.SWAP_UINT32:
+            values.byteswap()
+        return values
 
 
 class SAIARequestReadRegisters(SAIARequestReadAnalogItems):
@@ -501,8 +705,16 @@ class SAIARequestReadCounters(SAIARequestReadAnalogItems):
 
 
 class SAIARequestReadBooleanItems(SAIARequestReadItems):
+
+    # the 8 bits (lsb first) of each byte value
+    BITS = [tuple([bool(b & (1 << n)) for n in range(8)]) for b in range(256)]
+
     def extractValuesFromPayload(self, payload):
-        return unpack_bin(payload)
+        bits=self.BITS
+        values=[]
+        for b in bytearray(payload):
+            values.extend(bits[b])
+        return values
 
 
 class SAIARequestReadFlags(SAIARequestReadBooleanItems):
@@ -524,14 +736,24 @@ class SAIARequestWriteItems(SAIARequest):
     def setup(self, item, maxcount=1):
         self._item=item
 
-        values=[item.pushValue]
-        while len(values)<maxcount:
+        # the values array is reused when the request is recycled
+        try:
+            values=self._values
+            del values[:]
+        except AttributeError:
+            values=[]
+        values.append(item.pushValue)
+        # combine with the following consecutive pending push
+        count=item.parent.getPendingPushRun(item.index+1, maxcount-1)
+        for n in range(count):
             item=item.next()
-            if not item or not item.isPendingPushRequest():
+            if not item:
                 break
+            # values are taken now, a new write during the transaction will be pending again
+            item.clearPush()
             values.append(item.pushValue)
 
-        self._values=self.safeMakeArray(values)
+        self._values=values
         self.ready()
 
     @property
@@ -542,21 +764,54 @@ class SAIARequestWriteItems(SAIARequest):
         return self.item.parent
 
     def refreshItems(self):
+        """
+        Verify the written values, according to the memory write verification policy
+        """
         try:
             items=self.items()
             index0=self.item.index
-            for n in range(len(self._values)):
-                item=items[index0+n]
-                item.clearPush()
+            count=len(self._values)
+            policy=self.memory.getWriteVerificationPolicy()
+
+            for n in range(count):
+                item=items.item(index0+n)
                 if item:
-                    item.refresh(urgent=True)
+                    if policy==self.memory.WRITE_VERIFY_TRUST:
+                        # trust the ACK, unless a new value is already pending
+                        if not item.isPendingPushRequest():
+                            item.setValue(self._values[n], force=True, learn=False)
+                    elif policy==self.memory.WRITE_VERIFY_DEFERRED:
+                        item.refresh()
+
+            if policy==self.memory.WRITE_VERIFY_READBACK:
+                self.memory.submitReadback(items, index0, count)
         except:
             pass
 
     def onSuccess(self):
-        # after push (write oending value), we need a refresh to update the actual value
+        # after push (write pending value), we need a refresh to update the actual value
         self.refreshItems()
 
+    def onFailure(self):
+        super(SAIARequestWriteItems, self).onFailure()
+        self.restorePushes()
+
+    def restorePushes(self):
+        """
+        The combined values (cleared from the pending pushes when the frame was built) are
+        pushed again after a failed write, unless written again meanwhile. The head item
+        is not, a write failing for each of its items being dropped once per item
+        """
+        try:
+            items=self.items()
+            index0=self.item.index
+            for n in range(1, len(self._values)):
+                item=items.item(index0+n)
+                if item and not item.isPendingPushRequest():
+                    item.signalPush(self._values[n])
+        except:
+            pass
+
 
 class SAIARequestWriteBooleanItems(SAIARequestWriteItems):
     def encode(self):
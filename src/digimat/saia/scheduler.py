@@ -0,0 +1,415 @@
+from __future__ import division
+
+import time
+from collections import deque
+
+
+def percentile(samples, p):
+    """
+    Nearest-rank percentile (p in 0..100) of the given samples
+    """
+    if samples:
+        data=sorted(samples)
+        n=int(round(p/100.0*(len(data)-1)))
+        return data[min(max(n, 0), len(data)-1)]
+    return 0.0
+
+
+class SAIATrafficClass(object):
+    """
+    BaseClass for a class of traffic (push, urgent pull, background pull) served
+    by the SAIAScheduler. Subclasses give access to the pending items of the class
+    and process (initiate the request for) the selected item
+    """
+
+    NAME = None
+
+    def __init__(self, scheduler, weight=1, share=0.0):
+        self._scheduler=scheduler
+        self._weight=weight
+        self._share=share
+        self._deficit=0
+        self._ratio=0.0
+        self._count=0
+        self._latency=0.0
+        self._latencyMax=0.0
+        self._samples=deque(maxlen=256)
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def memory(self):
+        return self.scheduler.memory
+
+    @property
+    def name(self):
+        return self.NAME
+
+    def setWeight(self, weight):
+        self._weight=max(1, int(weight))
+
+    def getWeight(self):
+        return self._weight
+
+    def setShare(self, share):
+        """
+        Guaranteed minimum share of the frames (0..1) given to this class when it has pending items
+        """
+        self._share=min(max(float(share), 0.0), 1.0)
+
+    def getShare(self):
+        return self._share
+
+    def ratio(self):
+        """
+        Share of the recently sent frames that were given to this class
+        """
+        return self._ratio
+
+    def isStarving(self):
+        if self._share>0 and self._ratio<self._share:
+            return True
+        return False
+
+    def count(self):
+        return 0
+
+    def isPending(self):
+        if self.count()>0:
+            return True
+        return False
+
+    def getNextItem(self):
+        return None
+
+    def stamp(self, item):
+        return 0
+
+    def process(self, item):
+        return False
+
+    def onServed(self, item, served, alpha):
+        if served:
+            self._ratio+=alpha*(1.0-self._ratio)
+            self._count+=1
+            try:
+                stamp=self.stamp(item)
+                if stamp>0:
+                    latency=time.time()-stamp
+                    self._latency+=0.1*(latency-self._latency)
+                    self._latencyMax=max(self._latencyMax, latency)
+                    self._samples.append(latency)
+            except:
+                pass
+        else:
+            self._ratio-=alpha*self._ratio
+
+    def percentile(self, p):
+        """
+        Queue age (time between the item signal and its processing) percentile
+        """
+        return percentile(list(self._samples), p)
+
+    def stats(self):
+        samples=list(self._samples)
+        return {'weight': self._weight,
+            'share': self._share,
+            'ratio': self._ratio,
+            'pending': self.count(),
+            'count': self._count,
+            'latency': self._latency,
+            'latencyMax': self._latencyMax,
+            'p50': percentile(samples, 50),
+            'p90': percentile(samples, 90),
+            'p99': percentile(samples, 99)}
+
+    def __repr__(self):
+        return '<%s(weight=%d, share=%.02f, ratio=%.02f, pending=%d, latency=%.03fs)>' % (self.__class__.__name__,
+            self._weight, self._share, self._ratio, self.count(), self._latency)
+
+
+class SAIATrafficClassPush(SAIATrafficClass):
+    """
+    Writes, and the read back of the written frames (write verification) completing them : a
+    read back is served before the next push and charged to the class as any of its frames
+    """
+
+    NAME = 'push'
+
+    def count(self):
+        return self.memory.countPendingPush()+self.memory.countPendingReadback()
+
+    def isPending(self):
+        # pending pushes may be held for write combining
+        if self.memory.countPendingReadback()>0:
+            return True
+        return self.memory.isPushReady()
+
+    def getNextItem(self):
+        readback=self.memory.getNextReadback()
+        if readback:
+            return readback
+        return self.memory.getNextPendingPush()
+
+    def stamp(self, item):
+        if isinstance(item, tuple):
+            # read back (items, index, count, stamp)
+            return item[3]
+        return item._stampPush
+
+    def process(self, item):
+        if isinstance(item, tuple):
+            return self.memory.processReadback(item)
+        return item.push()
+
+
+class SAIATrafficClassUrgentPull(SAIATrafficClass):
+    NAME = 'urgent'
+
+    def count(self):
+        return self.memory.countPendingPriorityPull()
+
+    def getNextItem(self):
+        return self.memory.getNextPendingPriorityPull()
+
+    def stamp(self, item):
+        return item._stampPull
+
+    def process(self, item):
+        return item.pull()
+
+
+class SAIATrafficClassBackgroundPull(SAIATrafficClass):
+    NAME = 'background'
+
+    def count(self):
+        return self.memory.countPendingPull()
+
+    def getNextItem(self):
+        return self.memory.getNextPendingBackgroundPull()
+
+    def stamp(self, item):
+        return item._stampPull
+
+    def process(self, item):
+        return item.pull()
+
+    def onServed(self, item, served, alpha):
+        super(SAIATrafficClassBackgroundPull, self).onServed(item, served, alpha)
+        if served:
+            self.scheduler.updateLag(item)
+
+
+class SAIAScheduler(object):
+    """
+    Per server weighted fair queuing (deficit round robin) between the traffic classes.
+    Each class receives weight/sum(weights) of the frames when every class is busy, and
+    a class having pending items and receiving less than its guaranteed minimum share
+    is always served first. A busy writer can't starve the background polling anymore
+
+    The scheduler also accounts the background poll lag (how far behind schedule the polled
+    items are when processed). When the lag exceeds the threshold, the refresh of the low
+    priority items is degraded (load shedding), then the normal priority items if needed
+    """
+
+    SHED_LEVEL_MAX = 2
+
+    def __init__(self, memory):
+        assert memory.__class__.__name__=='SAIAMemory'
+        self._memory=memory
+        self._classes=[]
+        self._indexClass={}
+        self._current=0
+        self._fresh=True
+        self._alpha=1.0/32
+        self._lag=0.0
+        self._lagMax=0.0
+        self._lagSamples=deque(maxlen=256)
+        self._lagThreshold=15.0
+        self._shedding=True
+        self._shedLevel=0
+        self._shedFactor=4.0
+        self._timeoutShedding=0
+        self.declare(SAIATrafficClassPush(self, weight=4, share=0.1))
+        self.declare(SAIATrafficClassUrgentPull(self, weight=4, share=0.1))
+        self.declare(SAIATrafficClassBackgroundPull(self, weight=2, share=0.1))
+
+    @property
+    def memory(self):
+        return self._memory
+
+    @property
+    def logger(self):
+        return self.memory.logger
+
+    def declare(self, trafficClass):
+        assert isinstance(trafficClass, SAIATrafficClass)
+        self._classes.append(trafficClass)
+        self._indexClass[trafficClass.name]=trafficClass
+        return trafficClass
+
+    def get(self, name):
+        try:
+            return self._indexClass[name]
+        except:
+            pass
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def all(self):
+        return self._classes
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def setWeight(self, name, weight):
+        self.get(name).setWeight(weight)
+
+    def setShare(self, name, share):
+        self.get(name).setShare(share)
+
+    def setWeights(self, push=None, urgent=None, background=None):
+        for (name, weight) in (('push', push), ('urgent', urgent), ('background', background)):
+            if weight is not None:
+                self.setWeight(name, weight)
+
+    def setShares(self, push=None, urgent=None, background=None):
+        for (name, share) in (('push', push), ('urgent', urgent), ('background', background)):
+            if share is not None:
+                self.setShare(name, share)
+
+    def setLagThreshold(self, delay):
+        self._lagThreshold=float(delay)
+
+    def enableLoadShedding(self, state=True, threshold=None, factor=None):
+        self._shedding=bool(state)
+        if threshold is not None:
+            self.setLagThreshold(threshold)
+        if factor is not None:
+            self._shedFactor=max(1.0, float(factor))
+        if not self._shedding:
+            self._shedLevel=0
+
+    def disableLoadShedding(self):
+        self.enableLoadShedding(False)
+
+    def updateLag(self, item):
+        try:
+            if item._stamp>0:
+                # how late the item was regarding its refresh schedule
+                lag=max(0.0, time.time()-item._stamp-item.getRefreshDelay())
+            else:
+                lag=0.0
+            self._lag+=0.1*(lag-self._lag)
+            self._lagMax=max(self._lagMax, lag)
+            self._lagSamples.append(lag)
+        except:
+            pass
+
+    def lag(self):
+        return self._lag
+
+    def getShedLevel(self):
+        return self._shedLevel
+
+    def getShedFactor(self, priority):
+        """
+        Refresh delay multiplier for the given item priority (0=high, 1=normal, 2=low)
+        """
+        if self._shedLevel>0 and priority>self.SHED_LEVEL_MAX-self._shedLevel:
+            return self._shedFactor
+        return 1.0
+
+    def manager(self):
+        if time.time()>=self._timeoutShedding:
+            self._timeoutShedding=time.time()+1.0
+            if not self.get('background').isPending():
+                # nothing is waiting, we are on schedule
+                self._lag*=0.5
+
+            if self._shedding:
+                if self._lag>self._lagThreshold:
+                    if self._shedLevel<self.SHED_LEVEL_MAX:
+                        self._shedLevel+=1
+                        self._timeoutShedding=time.time()+15.0
+                        self.logger.warning('%s:poll lag %.01fs, degrading low priority items refresh (level %d)' % (self.memory.server.host,
+                            self._lag, self._shedLevel))
+                elif self._lag<self._lagThreshold/4.0:
+                    if self._shedLevel>0:
+                        self._shedLevel-=1
+                        self._timeoutShedding=time.time()+15.0
+                        self.logger.info('%s:poll lag %.01fs, restoring items refresh (level %d)' % (self.memory.server.host,
+                            self._lag, self._shedLevel))
+
+    def isPending(self):
+        for trafficClass in self._classes:
+            if trafficClass.isPending():
+                return True
+        return False
+
+    def served(self, trafficClass, item):
+        for c in self._classes:
+            c.onServed(item, c is trafficClass, self._alpha)
+        return (trafficClass, item)
+
+    def nextStarving(self):
+        for trafficClass in self._classes:
+            if trafficClass.isStarving() and trafficClass.isPending():
+                item=trafficClass.getNextItem()
+                if item:
+                    return self.served(trafficClass, item)
+
+    def nextRoundRobin(self):
+        # stateful deficit round robin (one frame per call, each frame has a cost of 1)
+        count=len(self._classes)*2
+        while count>0:
+            count-=1
+            trafficClass=self._classes[self._current]
+            if trafficClass.isPending():
+                if self._fresh:
+                    trafficClass._deficit+=trafficClass.getWeight()
+                    self._fresh=False
+                if trafficClass._deficit>=1:
+                    item=trafficClass.getNextItem()
+                    if item:
+                        trafficClass._deficit-=1
+                        return self.served(trafficClass, item)
+                    trafficClass._deficit=0
+            else:
+                trafficClass._deficit=0
+            self._current=(self._current+1) % len(self._classes)
+            self._fresh=True
+
+    def next(self):
+        """
+        Return the (trafficClass, item) tuple to be processed next, or None if nothing is pending
+        """
+        try:
+            selection=self.nextStarving()
+            if selection:
+                return selection
+            return self.nextRoundRobin()
+        except:
+            self.logger.exception('scheduler')
+
+    def stats(self):
+        samples=list(self._lagSamples)
+        stats={'lag': self._lag,
+            'lagMax': self._lagMax,
+            'lagP90': percentile(samples, 90),
+            'shedLevel': self._shedLevel}
+        for trafficClass in self._classes:
+            stats[trafficClass.name]=trafficClass.stats()
+        return stats
+
+    def __repr__(self):
+        return '<%s(%s, lag=%.01fs, shed=%d)>' % (self.__class__.__name__,
+            ', '.join(['%s=%d/%.02f' % (c.name, c.getWeight(), c.ratio()) for c in self._classes]),
+            self._lag, self._shedLevel)
+
+
+if __name__ == "__main__":
+    pass
@@ -2,6 +2,8 @@ from __future__ import print_function  # Python 2/3 compatibility
 
 import time
 import struct
+import os
+import json
 import ipaddress
 from datetime import datetime
 import re
@@ -22,6 +24,7 @@ from .transfer import SAIATransferDiscoverNodes
 from .transfer import SAIATransferFromRequest
 
 from .request import SAIASBusCRC
+from .request import SAIAFrameTemplateCache
 from .memory import SAIAMemory
 from .symbol import SAIASymbols
 
@@ -49,6 +52,17 @@ class SAIALink(object):
         self._retry=0
         self._msgseq=0
         self._msgcount=0
+        self._stampXmit=0
+        self._rtt=None
+        self._rttMax=0.0
+        self._timeoutCount=0
+        self._throughput=0.0
+        self._msgcountThroughput=0
+        self._timeoutThroughput=time.time()+1.0
+        self._frameCache=SAIAFrameTemplateCache()
+        self._pool={}
+        self._countAcquire=0
+        self._countRecycled=0
         self.reset()
 
     @property
@@ -62,6 +76,10 @@ class SAIALink(object):
     def logger(self):
         return self.server.logger
 
+    @property
+    def frameCache(self):
+        return self._frameCache
+
     def generateMsgSeq(self):
         self._msgseq+=1
         if self._msgseq>65535:
@@ -84,13 +102,42 @@ class SAIALink(object):
                 self.logger.error('%s:link dead!' % self.server)
 
     def reset(self, success=False):
+        request=self._request
         try:
-            self._request.stop(success)
+            request.stop(success)
         except:
             pass
         self._request=None
         self.setState(SAIALink.COMMSTATE_IDLE)
         self.checkAlive()
+        if request is not None:
+            self.release(request)
+
+    def acquire(self, requestClass):
+        """
+        Return a request of the given class, recycled from the link pool if available.
+        As the link handles one request at a time, the pool is very small
+        """
+        self._countAcquire+=1
+        try:
+            request=self._pool[requestClass].pop()
+            request.recycle()
+            self._countRecycled+=1
+            return request
+        except (KeyError, IndexError):
+            pass
+        request=requestClass(self)
+        request._pooled=True
+        return request
+
+    def release(self, request):
+        """
+        Give back a pooled request (done) to the link pool
+        """
+        if request._pooled and request.isDone():
+            pool=self._pool.setdefault(request.__class__, [])
+            if len(pool)<2 and request not in pool:
+                pool.append(request)
 
     def isAlive(self):
         if self._alive:
@@ -121,7 +168,46 @@ class SAIALink(object):
     def data2strhex(self, data):
         return ' '.join(x.encode('hex') for x in data)
 
+    def updateRtt(self):
+        if self._stampXmit>0:
+            rtt=time.time()-self._stampXmit
+            if self._rtt is None:
+                self._rtt=rtt
+            else:
+                self._rtt+=0.1*(rtt-self._rtt)
+            self._rttMax=max(self._rttMax, rtt)
+            self._stampXmit=0
+
+    def rtt(self):
+        """
+        Measured round trip time (request->response), None if not yet measured
+        """
+        return self._rtt
+
+    def throughput(self):
+        """
+        Measured frames/s sent on this link
+        """
+        return self._throughput
+
+    def capacity(self):
+        """
+        Estimated max frames/s this link can handle (one request at a time)
+        """
+        if self._rtt:
+            return 1.0/(self._rtt+self._delayXmitInhibit)
+
+    def updateThroughput(self):
+        now=time.time()
+        if now>=self._timeoutThroughput:
+            elapsed=now-self._timeoutThroughput+1.0
+            count=self._msgcount-self._msgcountThroughput
+            self._msgcountThroughput=self._msgcount
+            self._timeoutThroughput=now+1.0
+            self._throughput+=0.2*(count/elapsed-self._throughput)
+
     def manager(self):
+        self.updateThroughput()
         try:
             if self._state==SAIALink.COMMSTATE_IDLE:
                 self.checkAlive()
@@ -143,6 +229,7 @@ class SAIALink(object):
 
                     if self.server.node.sendMessageToHost(data, host, port=port):
                         self._msgcount+=1
+                        self._stampXmit=time.time()
                         self._timeoutXmitInhibit=time.time()+self._delayXmitInhibit
                         if self._request._broadcast:
                             self.setState(SAIALink.COMMSTATE_SUCCESS)
@@ -158,6 +245,7 @@ class SAIALink(object):
 
             elif self._state==SAIALink.COMMSTATE_WAITRESPONSE:
                 if self.isTimeout():
+                    self._timeoutCount+=1
                     self.logger.error('%s-->%s:timeout!' % (self.server.host, self._request.__class__.__name__))
                     self.setState(SAIALink.COMMSTATE_PENDINGREQUEST)
                 return True
@@ -214,11 +302,11 @@ class SAIALink(object):
         except:
             self.logger.exception('decodeMessage')
 
-    def resetWatchdog(self):
+    def resetWatchdog(self, delay=1.0):
         self._alive=True
-        self._timeoutWatchdog=time.time()+1.0
+        self._timeoutWatchdog=max(self._timeoutWatchdog, time.time()+delay)
 
-    def onMessage(self, mtype, mseq, payload):
+    def onMessage(self, mtype, mseq, payload, stamp=None):
         try:
             if mtype==0:    # Request
                 # must be intercepted at higher level
@@ -229,8 +317,10 @@ class SAIALink(object):
                     if self._request.validateMessage(mseq, payload):
                         try:
                             self.resetWatchdog()
+                            self.updateRtt()
                             if self.isDebug():
                                 self.logger.debug('%s-->%s:processResponse(%d bytes)' % (self.server.host, self._request, len(payload)))
+                            self._request.setReceiveStamp(stamp)
                             result=self._request.processResponse(payload)
                             self.reset(result)
                         except:
@@ -244,18 +334,24 @@ class SAIALink(object):
                             data=struct.unpack('%dB' % len(payload), payload)
 
                             code=data[0]
-                            # FIXME: meaning not clear yet (try to read an unexistant item,
-                            # like register 40000 -> returns am ACK with code=0 and code2=1)
-                            # code2=data[1]
-
-                            if code==0:
+                            self.updateRtt()
+                            # ACK/NAK code is a 16 bits word, code=0 and code2=1 is a NAK
+                            # (i.e. trying to read an unexistant item, like register 40000)
+                            code2=0
+                            if len(data)>1:
+                                code2=data[1]
+
+                            if code==0 and code2==0:
                                 self.resetWatchdog()
                                 if self.isDebug():
                                     self.logger.debug('%s-->ACK(mseq=%d)' % (self.server.host, mseq))
                                 self.reset(True)
                             else:
+                                if code==0:
+                                    self.resetWatchdog()
                                 if self.isDebug():
-                                    self.logger.error('%s-->NACK(mseq=%d, code=%d)' % (self.server.host, mseq, code))
+                                    self.logger.error('%s-->NACK(mseq=%d, code=%d)' % (self.server.host, mseq, (code << 8) | code2))
+                                self._request.onReject((code << 8) | code2)
                                 self.reset(False)
                         except:
                             self.logger.exception('processAck/Nak()')
@@ -264,6 +360,17 @@ class SAIALink(object):
         except:
             self.logger.exception('onMessage')
 
+    def stats(self):
+        return {'frames': self._msgcount,
+            'timeouts': self._timeoutCount,
+            'rtt': self._rtt,
+            'rttMax': self._rttMax,
+            'throughput': self._throughput,
+            'capacity': self.capacity(),
+            'frameCache': self._frameCache.stats(),
+            'requests': self._countAcquire,
+            'recycled': self._countRecycled}
+
     def __repr__(self):
         return '<%s(state=%d, alive=%d, mseq=%d, mcount=%d)' % (self.__class__.__name__, self._state, bool(self.isAlive()), self._msgseq, self._msgcount)
 
@@ -272,13 +379,20 @@ class SAIAServer(object):
 
     UDP_DEFAULT_PORT = 5050
 
+    WRITE_VERIFY_TRUST = SAIAMemory.WRITE_VERIFY_TRUST
+    WRITE_VERIFY_READBACK = SAIAMemory.WRITE_VERIFY_READBACK
+    WRITE_VERIFY_DEFERRED = SAIAMemory.WRITE_VERIFY_DEFERRED
+
     def __init__(self, node, host, lid=None, localNodeMode=False, mapfile=None, port=UDP_DEFAULT_PORT):
         assert node.__class__.__name__=='SAIANode'
         self._lock=RLock()
         self._node=node
         self._status=0
         self._timeoutStatus=0
+        self._stampStatus=0
         self._timeoutPause=0
+        self._indexRangesLoaded=False
+        self._timeoutIndexRanges=time.time()+60
         self._host=host
         self._port=port or node._port
         self._lid=lid
@@ -447,6 +561,43 @@ class SAIAServer(object):
     def setReadOnly(self, state=True):
         self.memory.setReadOnly(state)
 
+    def setAdaptiveRefresh(self, state=True, delayMin=None, delayMax=None):
+        self.memory.setAdaptiveRefresh(state, delayMin, delayMax)
+
+    @property
+    def scheduler(self):
+        return self.memory.scheduler
+
+    def setQueueWeights(self, push=None, urgent=None, background=None):
+        self.scheduler.setWeights(push, urgent, background)
+
+    def setQueueShares(self, push=None, urgent=None, background=None):
+        self.scheduler.setShares(push, urgent, background)
+
+    def setWriteCombiningDelay(self, delay):
+        self.memory.setWriteCombiningDelay(delay)
+
+    def setWriteVerificationPolicy(self, policy):
+        self.memory.setWriteVerificationPolicy(policy)
+
+    def enableItemStore(self):
+        return self.memory.enableItemStore()
+
+    def undeclare(self, items=None):
+        return self.memory.undeclare(items)
+
+    def generation(self):
+        return self.memory.generation()
+
+    def changesSince(self, generation=0):
+        return self.memory.changesSince(generation)
+
+    def enableLoadShedding(self, state=True, threshold=None, factor=None):
+        self.scheduler.enableLoadShedding(state, threshold, factor)
+
+    def lag(self):
+        return self.scheduler.lag()
+
     def isLocalNodeMode(self):
         return self._memory.isLocalNodeMode()
 
@@ -482,6 +633,46 @@ class SAIAServer(object):
             self.logger.exception('Error trying to load mapfile!')
             pass
 
+    def getIndexRangesFilePath(self):
+        try:
+            path=self.node.getMapFileStoragePath()
+            if path and not self.isLocalNodeMode():
+                return os.path.join(os.path.expanduser(path), '%s.ranges' % self.host)
+        except:
+            pass
+
+    def loadIndexRanges(self):
+        """
+        Load the learned readable/failing index ranges (stored in the .map file storage path)
+        """
+        fpath=self.getIndexRangesFilePath()
+        if fpath:
+            self._indexRangesLoaded=True
+            try:
+                if os.path.exists(fpath):
+                    with open(fpath, 'r') as f:
+                        self.memory.indexRangesFromData(json.load(f))
+                    self.logger.info('index ranges loaded from file [%s] for server %s' % (fpath, self))
+                    return True
+            except:
+                self.logger.exception('Error trying to load index ranges!')
+        return False
+
+    def saveIndexRanges(self, force=False):
+        fpath=self.getIndexRangesFilePath()
+        if fpath and (force or self.memory.isIndexRangesDirty()):
+            try:
+                with open(fpath, 'w') as f:
+                    json.dump(self.memory.indexRangesToData(), f)
+                self.memory.setIndexRangesDirty(False)
+                return True
+            except:
+                self.logger.exception('Error trying to save index ranges!')
+        return False
+
+    def clearIndexRanges(self):
+        self.memory.clearIndexRanges()
+
     def setDeviceInfo(self, key, value):
         try:
             if key and value:
@@ -513,8 +704,16 @@ class SAIAServer(object):
     def isPendingPushRequest(self):
         return self.memory.isPendingPushRequest()
 
-    def onMessage(self, mtype, mseq, payload):
-        return self.link.onMessage(mtype, mseq, payload)
+    def getWakeupDelay(self):
+        """
+        Time left (seconds) before the server has a held push to send (or None)
+        """
+        if self.isLocalNodeMode() or self._timeoutPause:
+            return None
+        return self.memory.getPushHoldDelay()
+
+    def onMessage(self, mtype, mseq, payload, stamp=None):
+        return self.link.onMessage(mtype, mseq, payload, stamp)
 
     def refresh(self):
         self.memory.refresh()
@@ -553,6 +752,12 @@ class SAIAServer(object):
 
                     if time.time()>self._timeoutStatus:
                         self.refreshStatus()
+
+                    if not self._indexRangesLoaded:
+                        self.loadIndexRanges()
+                    elif time.time()>self._timeoutIndexRanges:
+                        self._timeoutIndexRanges=time.time()+60
+                        self.saveIndexRanges()
                 else:
                     if self.link.isIdle():
                         self.link.readStationNumber()
@@ -594,6 +799,7 @@ class SAIAServer(object):
 
     def refreshStatus(self):
         self._timeoutStatus=time.time()+1.0
+        self._stampStatus=time.time()
         transfer=SAIATransferFromRequest(SAIARequestReadPcdStatusOwn(self.link))
         return self.submitTransfer(transfer)
 
@@ -601,6 +807,52 @@ class SAIAServer(object):
         self.refreshStatus()
         return self.isAlive()
 
+    def onFleetSweep(self, interval):
+        """
+        A broadcast READ_STATIONNUMBER reply was received from this server, proving that it is
+        alive. The unicast status polling is postponed (but still done every 30s to keep the
+        run status up to date)
+        """
+        self.link.resetWatchdog(2*interval+1.0)
+        if time.time()-self._stampStatus<30.0:
+            self._timeoutStatus=max(self._timeoutStatus, time.time()+2*interval)
+
+    def stats(self):
+        return {'host': self.host,
+            'lid': self.lid,
+            'alive': self.isAlive(),
+            'link': self.link.stats(),
+            'memory': self.memory.stats()}
+
+    def pollBudget(self, rtt=None, margin=0.8):
+        """
+        Estimate the frames/s required to poll the declared items at their refresh delay
+        (using the request packing limits) plus the status polling, and compare it with the
+        measured link capacity (or with the given rtt). The configuration is flagged as
+        not feasible if it requires more than margin x capacity
+        """
+        budget=self.memory.pollBudget()
+        # READ_PCD_STATUS_OWN is sent every second
+        required=budget['required']+1.0
+
+        if rtt is None:
+            rtt=self.link.rtt()
+        capacity=None
+        if rtt:
+            capacity=1.0/(rtt+self.link._delayXmitInhibit)
+
+        budget['host']=self.host
+        budget['required']=required
+        budget['rtt']=rtt
+        budget['throughput']=self.link.throughput()
+        budget['capacity']=capacity
+        budget['utilization']=None
+        budget['feasible']=None
+        if capacity:
+            budget['utilization']=required/capacity
+            budget['feasible']=required<=capacity*margin
+        return budget
+
     def __repr__(self):
         count=self._transfers.count()
         if count:
@@ -616,6 +868,12 @@ class SAIAServers(object):
         self._indexByLid={}
         self._indexByHost={}
         self._currentServer=0
+        self._fleetSweep=False
+        self._delayFleetSweep=1.0
+        self._timeoutFleetSweep=0
+        self._requestFleetSweep=None
+        self._fleetSweepCount=0
+        self._fleetSweepReplies=0
 
     @property
     def node(self):
@@ -666,6 +924,12 @@ class SAIAServers(object):
                 return True
         return False
 
+    def getWakeupDelay(self):
+        delays=[server.getWakeupDelay() for server in self.all()]
+        delays=[delay for delay in delays if delay is not None]
+        if delays:
+            return min(delays)
+
     def __iter__(self):
         return iter(self.all())
 
@@ -692,9 +956,67 @@ class SAIAServers(object):
             self.logger.exception('declareRange')
         return servers
 
+    def enableFleetSweep(self, state=True, interval=1.0):
+        """
+        Fleet liveness sweep : one broadcast READ_STATIONNUMBER is sent every interval and
+        the replies refresh the watchdog of the matching declared servers in bulk. Only the
+        servers that stayed silent fall back to the unicast READ_PCD_STATUS_OWN polling
+        """
+        self._fleetSweep=bool(state)
+        self._delayFleetSweep=max(0.1, float(interval))
+        self._timeoutFleetSweep=0
+
+    def disableFleetSweep(self):
+        self.enableFleetSweep(False)
+
+    def isFleetSweepEnabled(self):
+        if self._fleetSweep:
+            return True
+        return False
+
+    def fleetSweep(self):
+        request=SAIARequestReadStationNumber(self.node.server.link, broadcast=True)
+        self._requestFleetSweep=request
+        self._fleetSweepCount+=1
+        self.node.server.submitTransfer(SAIATransferFromRequest(request))
+
+    def onFleetSweepReply(self, host, mseq, payload):
+        """
+        Return True if the given response is a reply to the current fleet sweep
+        """
+        try:
+            request=self._requestFleetSweep
+            if request is None or mseq!=request.sequence or len(payload)!=1:
+                return False
+
+            (lid,)=struct.unpack('>B', payload)
+            server=self.getFromHost(host)
+            if server is None:
+                # undeclared host, ignored (the network scanner is responsible for the discovery)
+                return True
+
+            # the server link is waiting for a response using the same sequence
+            # number, give it the priority (the next sweep will do the job)
+            if server.link.isWaitingResponse() and server.link._request.validateMessage(mseq):
+                return False
+
+            if server.lid!=lid:
+                return False
+
+            self._fleetSweepReplies+=1
+            server.onFleetSweep(self._delayFleetSweep)
+            return True
+        except:
+            pass
+        return False
+
     def manager(self):
         activity=False
 
+        if self._fleetSweep and time.time()>=self._timeoutFleetSweep:
+            self._timeoutFleetSweep=time.time()+self._delayFleetSweep
+            self.fleetSweep()
+
         if self._servers:
             count=min(8, len(self._servers))
             while count>0:
@@ -718,10 +1040,31 @@ class SAIAServers(object):
     def count(self):
         return len(self._servers)
 
+    def stats(self):
+        return {'servers': self.count(),
+            'alive': len(self.alive()),
+            'fleetSweep': self.isFleetSweepEnabled(),
+            'fleetSweepCount': self._fleetSweepCount,
+            'fleetSweepReplies': self._fleetSweepReplies}
+
+    def pollBudget(self, rtt=None, margin=0.8):
+        budgets={}
+        for server in self._servers:
+            budget=server.pollBudget(rtt, margin)
+            budgets[server.host]=budget
+            if budget['feasible'] is False:
+                self.logger.warning('server %s poll budget not feasible (%.01f frames/s required, capacity %.01f frames/s)!' % (server.host,
+                    budget['required'], budget['capacity']))
+        return budgets
+
     def refresh(self):
         for server in self._servers:
             server.refresh()
 
+    def saveIndexRanges(self, force=False):
+        for server in self._servers:
+            server.saveIndexRanges(force)
+
     def run(self):
         for server in self._servers:
             server.run()
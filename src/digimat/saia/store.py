@@ -0,0 +1,366 @@
+from __future__ import division
+
+from array import array
+from itertools import compress
+from itertools import repeat
+from operator import and_
+from operator import eq
+from operator import ge
+from operator import lt
+
+
+class SAIAItemView(object):
+    """
+    Mixin mapping the value, timestamp and state flags of a SAIAItem to its collection store
+    (see SAIAItemStore.viewClass())
+    """
+
+    __slots__ = ()
+
+    @property
+    def _value(self):
+        return self._parent._store.getValue(self._index)
+
+    @_value.setter
+    def _value(self, value):
+        self._parent._store.setValue(self._index, value)
+
+    @property
+    def _stamp(self):
+        return self._parent._store._stamps[self._index]
+
+    @_stamp.setter
+    def _stamp(self, stamp):
+        self._parent._store._stamps[self._index]=stamp
+
+    @property
+    def _sample(self):
+        return self._parent._store._samples[self._index]
+
+    @_sample.setter
+    def _sample(self, sample):
+        self._parent._store._samples[self._index]=sample
+
+    @property
+    def _flags(self):
+        return self._parent._store._flags[self._index]
+
+    @property
+    def _snapshot(self):
+        return self._parent._store._snapshots[self._index]
+
+    @_snapshot.setter
+    def _snapshot(self, snapshot):
+        self._parent._store._snapshots[self._index]=snapshot
+
+    @_flags.setter
+    def _flags(self, flags):
+        # the declared/item flags are owned by the store
+        store=self._parent._store
+        mask=SAIAItemStore.FLAG_DECLARED | SAIAItemStore.FLAG_ITEM
+        store._flags[self._index]=(store._flags[self._index] & mask) | (flags & ~mask & 0xff)
+
+
+class SAIAItemStore(object):
+    """
+    Columnar storage of the items of a collection : values, timestamps, sample ids and state flags are kept
+    in typed arrays indexed by address, grown on demand up to the highest declared index.
+    Declared indexes don't need an item object, items (SAIAItem) being optional views on the
+    store created on demand. The (value, stamp) pair of each index is also published as an
+    immutable tuple, replaced at once by each update (lock-free consistent reads)
+    """
+
+    FLAG_DECLARED = 0x01
+    FLAG_ITEM = 0x02
+    FLAG_RAISED = 0x04
+    FLAG_CHANGED = 0x08
+    FLAG_UPDATED = 0x10
+    FLAG_VALUE = 0x20
+
+    # size of a published (value, stamp) slot reference (bytes)
+    SNAPSHOT_ITEMSIZE = 8
+
+    _viewClasses = {}
+
+    def __init__(self, maxsize, typecode='q'):
+        self._maxsize=maxsize
+        self._typecode=typecode
+        self._boolean=(typecode=='B')
+        self._values=array(typecode)
+        self._stamps=array('d')
+        self._samples=array('q')
+        self._flags=array('B')
+        self._snapshots=[]
+        self._empty=(self.getZero(), 0.0)
+        self._count=0
+
+    @classmethod
+    def viewClass(cls, itemType):
+        """
+        Return the item class storing its state in the store (itemType with the SAIAItemView mixin)
+        """
+        try:
+            return cls._viewClasses[itemType]
+        except KeyError:
+            view=type(itemType.__name__, (SAIAItemView, itemType), {'__slots__': ()})
+            cls._viewClasses[itemType]=view
+            return view
+
+    def size(self):
+        return len(self._flags)
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def reserve(self, size):
+        size=min(size, self._maxsize)
+        n=size-len(self._flags)
+        if n>0:
+            self._values.extend(array(self._typecode, [0])*n)
+            self._stamps.extend(array('d', [0.0])*n)
+            self._samples.extend(array('q', [0])*n)
+            self._flags.extend(array('B', [0])*n)
+            self._snapshots.extend([self._empty]*n)
+
+    def declare(self, index, count=1, value=0):
+        """
+        Declare the indexes [index, index+count), returning the number of new ones
+        """
+        end=min(index+count, self._maxsize)
+        self.reserve(end)
+        flags=self._flags
+        if end-index>1 and not any(flags[index:end]):
+            # new range, filled at once
+            count=end-index
+            try:
+                values=array(self._typecode, [value])*count
+            except:
+                values=array(self._typecode, [0])*count
+            flags[index:end]=array('B', [self.FLAG_DECLARED])*count
+            self._values[index:end]=values
+            self._stamps[index:end]=array('d', [0.0])*count
+            self._samples[index:end]=array('q', [0])*count
+            self._snapshots[index:end]=[(self.getValue(index), 0.0)]*count
+            self._count+=count
+            return count
+
+        declared=0
+        for n in range(index, end):
+            if not flags[n] & self.FLAG_DECLARED:
+                flags[n]=self.FLAG_DECLARED
+                self.setValue(n, value)
+                self._stamps[n]=0.0
+                self._samples[n]=0
+                self._snapshots[n]=(self.getValue(n), 0.0)
+                declared+=1
+        self._count+=declared
+        return declared
+
+    def undeclare(self, index, count=1):
+        """
+        Undeclare the indexes [index, index+count), clearing their state. Return the number of
+        undeclared indexes
+        """
+        end=min(index+count, len(self._flags))
+        if end<=index:
+            return 0
+        flags=self._flags
+        undeclared=len([n for n in range(index, end) if flags[n] & self.FLAG_DECLARED])
+        count=end-index
+        flags[index:end]=array('B', [0])*count
+        self._values[index:end]=array(self._typecode, [0])*count
+        self._stamps[index:end]=array('d', [0.0])*count
+        self._samples[index:end]=array('q', [0])*count
+        self._snapshots[index:end]=[self._empty]*count
+        self._count-=undeclared
+        return undeclared
+
+    def trim(self):
+        """
+        Release the arrays space above the highest declared index
+        """
+        flags=self._flags
+        size=len(flags)
+        while size>0 and not flags[size-1] & self.FLAG_DECLARED:
+            size-=1
+        if size<len(flags):
+            del self._values[size:]
+            del self._stamps[size:]
+            del self._samples[size:]
+            del self._snapshots[size:]
+            del flags[size:]
+        return size
+
+    def isDeclared(self, index):
+        try:
+            if self._flags[index] & self.FLAG_DECLARED:
+                return True
+        except:
+            pass
+        return False
+
+    def setItem(self, index, state=True):
+        if state:
+            self._flags[index] |= self.FLAG_ITEM
+        else:
+            self._flags[index] &= ~self.FLAG_ITEM & 0xff
+
+    def isItem(self, index):
+        try:
+            if self._flags[index] & self.FLAG_ITEM:
+                return True
+        except:
+            pass
+        return False
+
+    def getZero(self):
+        if self._boolean:
+            return False
+        return 0
+
+    def getValue(self, index):
+        if self._boolean:
+            return bool(self._values[index])
+        return self._values[index]
+
+    def setValue(self, index, value):
+        try:
+            self._values[index]=value
+        except:
+            pass
+
+    def getStamp(self, index):
+        return self._stamps[index]
+
+    def getSample(self, index):
+        return self._samples[index]
+
+    def getSnapshot(self, index):
+        return self._snapshots[index]
+
+    def snapshot(self, start, end):
+        """
+        Copy (C slices) of the state flags and of the published (value, stamp) pairs of the
+        indexes [start, end), without lock (a slice copy is atomic, see publish)
+        """
+        return (self._flags[start:end], self._snapshots[start:end])
+
+    def publish(self, index, snapshots):
+        """
+        Publish the (value, stamp) pairs of the indexes from index at once (slice assignment), the
+        caller holding the collection lock
+        """
+        self._snapshots[index:index+len(snapshots)]=snapshots
+
+    def testFlags(self, index, flags, reset=False):
+        """
+        Return the given state flags of index, clearing them if reset
+        """
+        state=self._flags[index] & flags
+        if state and reset:
+            self._flags[index] &= ~flags & 0xff
+        return state
+
+    def update(self, index, value, stamp, sample=0, publish=True):
+        """
+        Store a value received from the server (index without item), updating its state flags.
+        Unless publish, the caller publishes the (value, stamp) pair (see publish). Return True if
+        the value has changed
+        """
+        flags=self._flags[index] | self.FLAG_UPDATED | self.FLAG_VALUE
+        changed=False
+        if self._stamps[index]>0:
+            previous=self._values[index]
+            if not previous and value:
+                flags |= self.FLAG_RAISED
+            if value!=previous:
+                flags |= self.FLAG_CHANGED
+                changed=True
+        self._flags[index]=flags
+        self.setValue(index, value)
+        self._stamps[index]=stamp
+        self._samples[index]=sample
+        if publish:
+            self._snapshots[index]=(self.getValue(index), stamp)
+        return changed
+
+    def mask(self, items=None):
+        """
+        Iterator (C map over the flags array) of the declared state of each index, with (True) or
+        without (False) item, or all (None)
+        """
+        if items is None:
+            return map(bool, map(and_, self._flags, repeat(self.FLAG_DECLARED)))
+        state=self.FLAG_DECLARED
+        if items:
+            state |= self.FLAG_ITEM
+        mask=self.FLAG_DECLARED | self.FLAG_ITEM
+        return map(eq, map(and_, self._flags, repeat(mask)), repeat(state))
+
+    def indexes(self, items=None):
+        """
+        Declared indexes, with (True) or without (False) item, or all (None)
+        """
+        return list(compress(range(len(self._flags)), self.mask(items)))
+
+    def aged(self, deadline, alive=True):
+        """
+        Declared indexes without item whose value was received at or after deadline (alive), or
+        before it (not alive)
+        """
+        if alive:
+            test=ge
+        else:
+            test=lt
+        return list(compress(range(len(self._flags)),
+            map(and_, self.mask(False), map(test, self._stamps, repeat(deadline)))))
+
+    def nonzero(self):
+        """
+        Declared indexes without item whose value is not 0 (or False)
+        """
+        return list(compress(range(len(self._flags)), map(and_, self.mask(False), map(bool, self._values))))
+
+    def expired(self, deadline, start=0, count=None):
+        """
+        Scan count indexes from start, returning the declared indexes without item whose value
+        is older than deadline, and the next scan start
+        """
+        flags=self._flags
+        stamps=self._stamps
+        size=len(flags)
+        if start>=size:
+            start=0
+        end=size
+        if count is not None:
+            end=min(size, start+count)
+        mask=self.FLAG_DECLARED | self.FLAG_ITEM
+        declared=self.FLAG_DECLARED
+        indexes=[n for n in range(start, end) if flags[n] & mask == declared and stamps[n]<=deadline]
+        if end>=size:
+            end=0
+        return (indexes, end)
+
+    def nbytes(self):
+        return (len(self._values)*self._values.itemsize+
+            len(self._stamps)*self._stamps.itemsize+
+            len(self._samples)*self._samples.itemsize+
+            len(self._flags)*self._flags.itemsize+
+            len(self._snapshots)*self.SNAPSHOT_ITEMSIZE)
+
+    def stats(self):
+        return {'declared': self._count,
+            'size': len(self._flags),
+            'items': len([flags for flags in self._flags if flags & self.FLAG_ITEM]),
+            'bytes': self.nbytes()}
+
+    def __repr__(self):
+        return '<%s(declared=%d, size=%d, bytes=%d)>' % (self.__class__.__name__,
+            self._count, len(self._flags), self.nbytes())
+
+
+if __name__ == "__main__":
+    pass